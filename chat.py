@@ -1,9 +1,9 @@
 # chat.py
 import os
 import sys
-import base64
-import socket
-import json
+import logging
+import bisect
+import collections
 import tkinter as tk
 from tkinter import (
     Tk,
@@ -20,12 +20,32 @@ from tkinter import (
     Toplevel,
 )
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tkinter import filedialog
 from p2p_chat import P2PChat
 import file_transfer
-from utils import send_message
 from presence_client import PresenceClient
 
+# Problems that cannot be shown in the chat window itself
+logger = logging.getLogger(__name__)
+
+# Chat display updates are batched and rendered at most every ~16 ms (60 Hz)
+UI_PUMP_INTERVAL_MS = 16
+UI_PUMP_BATCH_SIZE = 200  # Messages rendered per tick at most
+
+# Text tags used by the chat display, configured once per chat screen
+CHAT_TAG_STYLES = {
+    # Center-align system messages
+    "center": {"justify": "center", "foreground": "gray", "font": ("Helvetica", 10)},
+    # Right-align your messages
+    "right": {"justify": "right", "foreground": "blue", "font": ("Helvetica", 12)},
+    # Left-align others' messages
+    "left": {"justify": "left", "foreground": "green", "font": ("Helvetica", 12)},
+}
+
+# Longest the app waits for network cleanup after the window is closed
+SHUTDOWN_DEADLINE_MS = 1500
+
 
 class ChatUI:
     def __init__(self, root):
@@ -37,29 +57,24 @@ class ChatUI:
         self.username = ""
         self.chat_display = None
         self.peer_status = {}  # Track peer status
+        self._ui_queue = collections.deque()  # (text, tag) waiting to be rendered
+        self._pump_scheduled = False
+        self._peers_refresh_scheduled = False
+        self._welcome_image = self._load_welcome_image()  # None if unavailable
+        # Screens are built once and then shown or hidden, not rebuilt
+        self._screens = {}  # name -> Frame
+        self._current_screen = None
         self.setup_welcome_screen()
+        # File chunks are sent over the FileTransfer's own persistent
+        # per-peer connections
         self.file_transfer = file_transfer.FileTransfer(
-            message_sender=self._send_message_to_peer,
             downloads_folder="downloads",
             ui_callback=self.update_chat_display,  # Pass UI callback
         )
         self.presence_client = None
-
-    def _send_message_to_peer(self, peer_addr, message: dict):
-        """
-        Given a peer address (host, port) and a message dict,
-        connect, send the JSON, then close the socket.
-        """
-        host, port = peer_addr
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            # Use improved send_message function from utils
-            send_message(sock, message)
-            sock.close()
-            print(f"Sent chunk of size {len(message.get('data', ''))} to {peer_addr}")
-        except Exception as e:
-            print(f"Error in _send_message_to_peer({peer_addr}): {e}")
+        # Outgoing chat messages are broadcast by one background worker, so
+        # the Tk loop never waits on the network and messages keep their order
+        self._send_executor = ThreadPoolExecutor(max_workers=1)
 
     def select_file(self):
         file_path = filedialog.askopenfilename()
@@ -68,21 +83,83 @@ class ChatUI:
             self.update_chat_display(f"System: Sending file '{filename}' ...")
             # Option 1: Broadcast file to every known peer
             if self.chat_instance and self.chat_instance.peers:
-                for peer_username, peer_info in self.chat_instance.peers.items():
-                    target_addr = (peer_info["address"], peer_info["port"])
-                    self.file_transfer.send_file(file_path, target_addr=target_addr)
+                peers_list = list(self.chat_instance.peers.items())
+
+                # Send in the background so the Tk main loop never blocks on I/O
+                broadcast_thread = threading.Thread(
+                    target=self._broadcast_file, args=(file_path, peers_list)
+                )
+                broadcast_thread.daemon = True
+                broadcast_thread.start()
+            else:
+                self.update_chat_display("System: No peers to send the file to.")
+
+    def _broadcast_file(self, file_path, peers_list):
+        """
+        Send a file to all given peers concurrently.
+
+        Each peer gets its own worker, so the total time is bounded by the
+        slowest peer rather than the sum over all peers.
+
+        Args:
+            file_path: Path to the file to send
+            peers_list: List of (username, peer_info) tuples
+        """
+        filename = os.path.basename(file_path)
+        with ThreadPoolExecutor(max_workers=len(peers_list)) as executor:
+            futures = {
+                executor.submit(
+                    self.file_transfer.send_file,
+                    file_path,
+                    target_addr=(peer_info["address"], peer_info["port"]),
+                    sender=self.username,
+                ): peer_username
+                for peer_username, peer_info in peers_list
+            }
+            for future in as_completed(futures):
+                peer_username = futures[future]
+                try:
+                    future.result()
                     self.update_chat_display(
                         f"System: File '{filename}' sent to {peer_username}"
                     )
-            else:
-                self.update_chat_display("System: No peers to send the file to.")
+                except Exception as e:
+                    self.update_chat_display(
+                        f"System: Failed to send '{filename}' to {peer_username}: {e}"
+                    )
+
+    def _show_screen(self, name, build):
+        """
+        Show one of the persistent screen frames, hiding the current one.
+
+        Args:
+            name: Key of the screen in self._screens
+            build: Function that fills a new Frame the first time it is shown
+        """
+        frame = self._screens.get(name)
+        if frame is None:
+            frame = self._screens[name] = Frame(self.root)
+            build(frame)
+
+        if self._current_screen is not None and self._current_screen is not frame:
+            self._current_screen.pack_forget()
+        frame.pack(fill=tk.BOTH, expand=True)
+        self._current_screen = frame
+
+    def _load_welcome_image(self):
+        """Load and scale the welcome logo once; returns None if it can't be loaded"""
+        try:
+            return PhotoImage(file="chat.png").subsample(4, 4)
+        except Exception as e:
+            logger.warning("Could not load image: %s", e)
+            return None
 
     def setup_welcome_screen(self):
-        for widget in self.root.winfo_children():
-            widget.destroy()
+        self._show_screen("welcome", self._build_welcome_screen)
 
+    def _build_welcome_screen(self, parent):
         welcome_label = tk.Label(
-            self.root,
+            parent,
             text="Welcome to P2P Chat",
             font=("Helvetica", 24, "bold"),
             pady=20,
@@ -90,7 +167,7 @@ class ChatUI:
         welcome_label.pack()
 
         intro_text = tk.Label(
-            self.root,
+            parent,
             text="Connect directly with friends using peer-to-peer technology. No servers, no tracking, just private communication.",
             font=("Helvetica", 12),
             wraplength=300,
@@ -98,26 +175,23 @@ class ChatUI:
         )
         intro_text.pack(pady=10)
 
-        try:
-            image = PhotoImage(file="chat.png")
-            image = image.subsample(4, 4)
-            image_label = Label(self.root, image=image)
-            image_label.image = image
+        if self._welcome_image is not None:
+            image_label = Label(parent, image=self._welcome_image)
+            image_label.image = self._welcome_image
             image_label.pack(pady=20)
-        except Exception as e:
-            print(f"Could not load image: {e}")
-            placeholder = Label(self.root, text="[Chat Icon]", font=("Helvetica", 18))
+        else:
+            placeholder = Label(parent, text="[Chat Icon]", font=("Helvetica", 18))
             placeholder.pack(pady=20)
 
         username_label = tk.Label(
-            self.root, text="Please enter your username:", font=("Helvetica", 14)
+            parent, text="Please enter your username:", font=("Helvetica", 14)
         )
         username_label.pack(pady=10)
 
-        self.username_entry = tk.Entry(self.root, font=("Helvetica", 14))
+        self.username_entry = tk.Entry(parent, font=("Helvetica", 14))
         self.username_entry.pack(pady=10)
 
-        button_frame = Frame(self.root)
+        button_frame = Frame(parent)
         button_frame.pack(pady=20)
 
         create_button = tk.Button(
@@ -174,11 +248,11 @@ class ChatUI:
             return
 
         self.username = username
-        for widget in self.root.winfo_children():
-            widget.destroy()
+        self._show_screen("join", self._build_join_screen)
 
+    def _build_join_screen(self, parent):
         # Create a container frame for the join options
-        join_container = Frame(self.root)
+        join_container = Frame(parent)
         join_container.pack(fill=tk.BOTH, expand=True, padx=20, pady=20)
 
         # Add a label
@@ -275,31 +349,31 @@ class ChatUI:
 
     def _show_direct_connection_screen(self):
         """Show the direct connection UI (original join screen)"""
-        for widget in self.root.winfo_children():
-            widget.destroy()
+        self._show_screen("direct", self._build_direct_connection_screen)
 
+    def _build_direct_connection_screen(self, parent):
         join_label = Label(
-            self.root,
+            parent,
             text="Direct Connection",
             font=("Helvetica", 20, "bold"),
             pady=20,
         )
         join_label.pack()
 
-        host_label = Label(self.root, text="Host address:", font=("Helvetica", 14))
+        host_label = Label(parent, text="Host address:", font=("Helvetica", 14))
         host_label.pack(pady=5)
 
-        self.host_entry = Entry(self.root, font=("Helvetica", 14))
+        self.host_entry = Entry(parent, font=("Helvetica", 14))
         self.host_entry.insert(0, "127.0.0.1")
         self.host_entry.pack(pady=5)
 
-        port_label = Label(self.root, text="Port:", font=("Helvetica", 14))
+        port_label = Label(parent, text="Port:", font=("Helvetica", 14))
         port_label.pack(pady=5)
 
-        self.port_entry = Entry(self.root, font=("Helvetica", 14))
+        self.port_entry = Entry(parent, font=("Helvetica", 14))
         self.port_entry.pack(pady=5)
 
-        button_frame = Frame(self.root)
+        button_frame = Frame(parent)
         button_frame.pack(pady=20)
 
         join_button = Button(
@@ -331,9 +405,6 @@ class ChatUI:
 
     def _show_presence_connection_screen(self):
         """Show the presence-based connection UI"""
-        for widget in self.root.winfo_children():
-            widget.destroy()
-
         # Create and set up the chat instance first
         self.setup_chat_screen()
         self.chat_instance = P2PChat(
@@ -410,54 +481,21 @@ class ChatUI:
         canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
 
-        # Fetch online users
-        online_users = self.presence_client.get_online_users()
+        # Rows are created once per user and updated in place on refresh
+        self._online_users_frame = scrollable_frame
+        self._user_row_widgets = {}  # (address, port) -> widgets of that row
+        self._users_status_label = Label(
+            scrollable_frame, font=("Helvetica", 12), fg="gray", pady=20
+        )
 
-        if not online_users:
-            no_users_label = Label(
-                scrollable_frame,
-                text="No online users found",
-                font=("Helvetica", 12),
-                fg="gray",
-                pady=20,
-            )
-            no_users_label.pack()
+        # Show cached users right away, otherwise fetch them off the UI thread
+        cached_users = self.presence_client.cached_online_users()
+        if cached_users is not None:
+            self._populate_users_dialog(cached_users)
         else:
-            # Display each user with a connect button
-            for user in online_users:
-                user_frame = Frame(scrollable_frame, borderwidth=1, relief="groove")
-                user_frame.pack(fill=tk.X, pady=5, padx=3)
-
-                username = user.get("username", "Unknown")
-                address = user.get("address", "Unknown")
-                port = user.get("port", "Unknown")
-
-                # Username label
-                user_label = Label(
-                    user_frame, text=username, font=("Helvetica", 12, "bold")
-                )
-                user_label.pack(anchor=tk.W, padx=10, pady=(5, 0))
-
-                # Address and port
-                addr_label = Label(
-                    user_frame,
-                    text=f"{address}:{port}",
-                    font=("Helvetica", 10),
-                    fg="gray",
-                )
-                addr_label.pack(anchor=tk.W, padx=10, pady=(0, 5))
-
-                # Connect button
-                connect_btn = Button(
-                    user_frame,
-                    text="Connect",
-                    bg="#4CAF50",
-                    fg="white",
-                    command=lambda a=address, p=port: self.connect_to_presence_user(
-                        a, p
-                    ),
-                )
-                connect_btn.pack(anchor=tk.E, padx=10, pady=5)
+            self._users_status_label.config(text="Loading…")
+            self._users_status_label.pack()
+            self._start_online_users_refresh()
 
         # Button frame at bottom
         button_frame = Frame(self.online_users_dialog)
@@ -469,7 +507,7 @@ class ChatUI:
             text="Refresh",
             bg="#2196F3",
             fg="white",
-            command=self.show_online_users_dialog,  # Just reopen to refresh
+            command=self._refresh_online_users_dialog,
         )
         refresh_btn.pack(side=tk.LEFT, padx=5)
 
@@ -481,6 +519,86 @@ class ChatUI:
         )
         cancel_btn.pack(side=tk.RIGHT, padx=5)
 
+    def _refresh_online_users_dialog(self):
+        """Bypass the cached user list and refetch it for the open dialog"""
+        self._start_online_users_refresh(force=True)
+
+    def _start_online_users_refresh(self, force=False):
+        """Fetch the online users in a background thread"""
+        refresh_thread = threading.Thread(
+            target=self._refresh_online_users, args=(force,)
+        )
+        refresh_thread.daemon = True
+        refresh_thread.start()
+
+    def _refresh_online_users(self, force=False):
+        """Fetch online users in a background thread and hand them to the UI"""
+        online_users = self.presence_client.get_online_users(force=force)
+        self.root.after(0, self._populate_users_dialog, online_users)
+
+    def _populate_users_dialog(self, online_users):
+        """Update the online users dialog, creating rows only for new users"""
+        # The dialog may have been closed while the users were being fetched
+        if not self.online_users_dialog or not self.online_users_dialog.winfo_exists():
+            return
+
+        # Remove rows of users that went offline
+        users = {(user.get("address"), user.get("port")): user for user in online_users}
+        for key in list(self._user_row_widgets):
+            if key not in users:
+                self._user_row_widgets.pop(key)["frame"].destroy()
+
+        if not users:
+            self._users_status_label.config(text="No online users found")
+            self._users_status_label.pack()
+            return
+        self._users_status_label.pack_forget()
+
+        # Display each user with a connect button
+        for key, user in users.items():
+            username = user.get("username", "Unknown")
+            row = self._user_row_widgets.get(key)
+            if row is None:
+                self._user_row_widgets[key] = self._create_user_row(key, username)
+            elif row["user_label"].cget("text") != username:
+                row["user_label"].config(text=username)
+
+    def _create_user_row(self, key, username):
+        """Create the widgets for one row of the online users dialog"""
+        address, port = key
+        if address is None:
+            address = "Unknown"
+        if port is None:
+            port = "Unknown"
+
+        user_frame = Frame(self._online_users_frame, borderwidth=1, relief="groove")
+        user_frame.pack(fill=tk.X, pady=5, padx=3)
+
+        # Username label
+        user_label = Label(user_frame, text=username, font=("Helvetica", 12, "bold"))
+        user_label.pack(anchor=tk.W, padx=10, pady=(5, 0))
+
+        # Address and port
+        addr_label = Label(
+            user_frame,
+            text=f"{address}:{port}",
+            font=("Helvetica", 10),
+            fg="gray",
+        )
+        addr_label.pack(anchor=tk.W, padx=10, pady=(0, 5))
+
+        # Connect button
+        connect_btn = Button(
+            user_frame,
+            text="Connect",
+            bg="#4CAF50",
+            fg="white",
+            command=lambda a=address, p=port: self.connect_to_presence_user(a, p),
+        )
+        connect_btn.pack(anchor=tk.E, padx=10, pady=5)
+
+        return {"frame": user_frame, "user_label": user_label}
+
     def connect_to_presence_user(self, address, port):
         """Connect to a user selected from the online users list"""
         # Close the dialog
@@ -541,15 +659,25 @@ class ChatUI:
             else:
                 self.update_chat_display(f"System: {peer_username} is now offline")
 
-        # Update the UI if the peers dialog is open
-        if hasattr(self, "peers_window") and self.peers_window:
-            self.show_peers()
+        # Update the UI if the peers dialog is open; this is called from network
+        # threads, so the refresh is handed to the Tk main loop. A burst of
+        # status changes is coalesced into a single refresh per UI tick.
+        if not self._peers_refresh_scheduled:
+            self._peers_refresh_scheduled = True
+            self.root.after(UI_PUMP_INTERVAL_MS, self._flush_peers_refresh)
+
+    def _flush_peers_refresh(self):
+        """Apply all peer status changes queued since the last tick"""
+        self._peers_refresh_scheduled = False
+        self._refresh_peers_window()
 
     def setup_chat_screen(self):
-        for widget in self.root.winfo_children():
-            widget.destroy()
+        self._show_screen("chat", self._build_chat_screen)
+        # The screen may be reused, so refresh the name it shows
+        self._username_label.config(text=f"Username: {self.username}")
 
-        header_frame = Frame(self.root, bg="#2196F3")
+    def _build_chat_screen(self, parent):
+        header_frame = Frame(parent, bg="#2196F3")
         header_frame.pack(fill=tk.X)
 
         username_label = Label(
@@ -561,6 +689,7 @@ class ChatUI:
             pady=10,
         )
         username_label.pack(side=tk.LEFT, padx=10)
+        self._username_label = username_label
 
         peers_button = Button(
             header_frame,
@@ -587,19 +716,23 @@ class ChatUI:
         status_label.pack(side=tk.RIGHT, padx=10, pady=8)
         self.status_indicator = status_label
 
-        chat_frame = Frame(self.root)
+        chat_frame = Frame(parent)
         chat_frame.pack(fill=tk.BOTH, expand=True)
 
         self.chat_display = Text(chat_frame, wrap=tk.WORD, state=tk.DISABLED)
         self.chat_display.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
+        # Configure the message styles once; update_chat_display only applies them
+        for tag, style in CHAT_TAG_STYLES.items():
+            self.chat_display.tag_configure(tag, **style)
+
         scrollbar = Scrollbar(chat_frame)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
         self.chat_display.config(yscrollcommand=scrollbar.set)
         scrollbar.config(command=self.chat_display.yview)
 
-        input_frame = Frame(self.root)
+        input_frame = Frame(parent)
         input_frame.pack(fill=tk.X, pady=10)
 
         self.message_entry = Entry(input_frame, font=("Helvetica", 12))
@@ -635,9 +768,13 @@ class ChatUI:
                 self.on_closing()
                 return
 
-            self.update_chat_display(f"{self.username}: {message}")
+            # Our own messages are laid out directly rather than being
+            # joined into "username: content" and split apart again
+            self._queue_chat_text(f"{self.username}:\n{message}\n\n", "right")
             if self.chat_instance:
-                self.chat_instance.broadcast_message(message)
+                self._send_executor.submit(
+                    self.chat_instance.broadcast_message, message
+                )
             self.message_entry.delete(0, tk.END)
 
     # def select_file(self):
@@ -648,74 +785,96 @@ class ChatUI:
 
     def update_chat_display(self, message):
         if not hasattr(self, "chat_display") or self.chat_display is None:
-            print(f"Can't display message yet: {message}")
+            logger.warning("Can't display message yet: %s", message)
             return
 
-        def _update():
-            try:
-                self.chat_display.config(state=tk.NORMAL)
+        # Lay the message out on the calling (usually network) thread
+        self._queue_chat_text(*self._format_chat_message(message))
 
-                # Split the message into username and content
-                if ": " in message:
-                    username, content = message.split(": ", 1)
-                else:
-                    username, content = "System", message
-
-                # Determine alignment and styling based on the username
-                if username == "System":
-                    # Center-align system messages and use 80% of the screen width
-                    self.chat_display.tag_configure(
-                        "center",
-                        justify="center",
-                        foreground="gray",
-                        font=("Helvetica", 10),
-                    )
-                    self.chat_display.insert(tk.END, f"{content}\n\n", "center")
-                elif username == self.username:
-                    # Right-align your messages
-                    self.chat_display.tag_configure(
-                        "right",
-                        justify="right",
-                        foreground="blue",
-                        font=("Helvetica", 12),
-                    )
-                    self.chat_display.insert(tk.END, f"{username}:\n", "right")
-                    self.chat_display.insert(tk.END, f"{content}\n\n", "right")
+    def _queue_chat_text(self, text, tag):
+        """
+        Queue laid-out text for the chat display.
+
+        Args:
+            text: Text to insert, including trailing newlines
+            tag: Display tag selecting the alignment
+        """
+        # A single Tk callback renders the batch; deque appends are
+        # thread-safe, so any thread may call this
+        self._ui_queue.append((text, tag))
+        if not self._pump_scheduled:
+            self._pump_scheduled = True
+            self.root.after(UI_PUMP_INTERVAL_MS, self._pump_chat_display)
+
+    def _pump_chat_display(self):
+        """Render queued chat messages in one batch on the Tk main thread"""
+        # Clear the flag before draining so messages queued meanwhile reschedule
+        self._pump_scheduled = False
+        if not self._ui_queue:
+            return
+
+        try:
+            # Bound the work per tick so a flood of messages can't starve input.
+            # Consecutive messages with the same alignment are joined so the
+            # whole batch goes to Tk as a single insert call.
+            chunks = []  # Alternating text, tag arguments for insert()
+            for _ in range(min(len(self._ui_queue), UI_PUMP_BATCH_SIZE)):
+                text, tag = self._ui_queue.popleft()
+                if chunks and chunks[-1] == tag:
+                    chunks[-2] += text
                 else:
-                    # Left-align others' messages
-                    self.chat_display.tag_configure(
-                        "left",
-                        justify="left",
-                        foreground="green",
-                        font=("Helvetica", 12),
-                    )
-                    self.chat_display.insert(tk.END, f"{username}:\n", "left")
-                    self.chat_display.insert(tk.END, f"{content}\n\n", "left")
+                    chunks += [text, tag]
 
-                self.chat_display.see(tk.END)  # Scroll to the end
-                self.chat_display.config(state=tk.DISABLED)
-            except tk.TclError as e:
-                print(f"TclError in update_chat_display: {e}")
+            self.chat_display.config(state=tk.NORMAL)
+            self.chat_display.insert(tk.END, *chunks)
+            self.chat_display.see(tk.END)  # Scroll to the end
+            self.chat_display.config(state=tk.DISABLED)
+        except tk.TclError as e:
+            logger.error("TclError in update_chat_display: %s", e)
+
+        if self._ui_queue and not self._pump_scheduled:
+            self._pump_scheduled = True
+            self.root.after(UI_PUMP_INTERVAL_MS, self._pump_chat_display)
+
+    def _format_chat_message(self, message):
+        """
+        Lay out a single message for the chat display.
 
-        # Ensure thread-safe UI updates
-        if threading.current_thread() is not threading.main_thread():
-            self.root.after(0, _update)
+        Args:
+            message: Text in the form "username: content" (or plain system text)
+
+        Returns:
+            (text, tag) tuple, where tag selects the alignment
+        """
+        # Split the message into username and content
+        username, separator, content = message.partition(": ")
+        if not separator:
+            username, content = "System", message
+
+        # Determine alignment and styling based on the username
+        if username == "System":
+            return f"{content}\n\n", "center"
+        elif username == self.username:
+            return f"{username}:\n{content}\n\n", "right"
         else:
-            _update()
+            return f"{username}:\n{content}\n\n", "left"
 
     def show_peers(self):
         """Show a dialog with the list of peers and their status"""
         if not self.chat_instance:
             return
 
-        # If the peers window is already open, close it and create a new one
-        if hasattr(self, "peers_window") and self.peers_window:
-            self.peers_window.destroy()
+        # If the peers window is already open, just bring its rows up to date
+        if self._peers_window_exists():
+            self._refresh_peers_window()
+            self.peers_window.lift()
+            return
 
         # Create a new Toplevel window for the peers list
         self.peers_window = tk.Toplevel(self.root)
         self.peers_window.title("Connected Peers")
         self.peers_window.geometry("300x400")
+        self.peers_window.protocol("WM_DELETE_WINDOW", self._close_peers_window)
 
         # Create a Label for the title
         title_label = Label(
@@ -746,61 +905,15 @@ class ChatUI:
         canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
 
-        # Add peer entries
-        with self.chat_instance.lock:
-            peers_list = list(self.chat_instance.peers.items())
-
-        if not peers_list:
-            no_peers_label = Label(
-                scrollable_frame, text="No peers connected", font=("Helvetica", 12)
-            )
-            no_peers_label.pack(pady=10)
-        else:
-            # Sort peers by status (online first) then by username
-            peers_list.sort(
-                key=lambda x: (x[1].get("status", "offline") != "online", x[0].lower())
-            )
-
-            for peer_username, peer_info in peers_list:
-                peer_frame = Frame(scrollable_frame, borderwidth=1, relief="groove")
-                peer_frame.pack(fill=tk.X, pady=5, padx=3)
-
-                # Status indicator (colored circle)
-                status = peer_info.get("status", "offline")
-                status_color = (
-                    "#4CAF50" if status == "online" else "#F44336"
-                )  # Green if online, red if offline
-
-                status_indicator = Frame(
-                    peer_frame, bg=status_color, width=10, height=10
-                )
-                status_indicator.pack(side=tk.LEFT, padx=10, pady=10)
-
-                # Username and address
-                peer_label = Label(
-                    peer_frame,
-                    text=f"{peer_username}",
-                    font=("Helvetica", 12, "bold"),
-                )
-                peer_label.pack(side=tk.LEFT, padx=5, pady=5)
-
-                address_label = Label(
-                    peer_frame,
-                    text=f"({peer_info['address']}:{peer_info['port']})",
-                    font=("Helvetica", 10),
-                    fg="gray",
-                )
-                address_label.pack(side=tk.LEFT, padx=5, pady=5)
-
-                # Status text
-                status_text = "Online" if status == "online" else "Offline"
-                status_label = Label(
-                    peer_frame,
-                    text=status_text,
-                    font=("Helvetica", 10),
-                    fg=status_color,
-                )
-                status_label.pack(side=tk.RIGHT, padx=10, pady=5)
+        # Rows are created once per peer and updated in place afterwards
+        self._peers_frame = scrollable_frame
+        self._peer_row_widgets = {}  # username -> widgets of that peer's row
+        self._peer_row_order = []
+        self._sorted_peers = []  # (sort key, username), kept sorted incrementally
+        self._no_peers_label = Label(
+            scrollable_frame, text="No peers connected", font=("Helvetica", 12)
+        )
+        self._refresh_peers_window()
 
         # Add a close button at the bottom
         close_button = Button(
@@ -809,18 +922,151 @@ class ChatUI:
             font=("Helvetica", 12),
             bg="#2196F3",
             fg="white",
-            command=lambda: self.peers_window.destroy(),
+            command=self._close_peers_window,
         )
         close_button.pack(pady=10)
 
+    def _peers_window_exists(self):
+        """Check whether the peers dialog is currently open"""
+        return bool(
+            getattr(self, "peers_window", None) and self.peers_window.winfo_exists()
+        )
+
+    def _close_peers_window(self):
+        """Close the peers dialog and forget its rows"""
+        if self._peers_window_exists():
+            self.peers_window.destroy()
+        self.peers_window = None
+        self._peer_row_widgets = {}
+
+    def _refresh_peers_window(self):
+        """Update the peers dialog, touching only rows whose peer changed"""
+        if not self._peers_window_exists():
+            return
+
+        # Add peer entries; peers is replaced rather than mutated, so the
+        # current dict can be read without the lock or a copy
+        peers = self.chat_instance.peers
+
+        # Remove rows of peers that are gone
+        for peer_username in list(self._peer_row_widgets):
+            if peer_username not in peers:
+                row = self._peer_row_widgets.pop(peer_username)
+                self._unindex_peer_row(peer_username, row)
+                row["frame"].destroy()
+
+        # Create rows for new peers and reconfigure existing ones in place
+        for peer_username, peer_info in peers.items():
+            row = self._peer_row_widgets.get(peer_username)
+            if row is None:
+                row = self._peer_row_widgets[peer_username] = self._create_peer_row(
+                    peer_username
+                )
+
+            # Status indicator (colored circle)
+            status = peer_info.get("status", "offline")
+            status_color = (
+                "#4CAF50" if status == "online" else "#F44336"
+            )  # Green if online, red if offline
+            status_text = "Online" if status == "online" else "Offline"
+            address_text = f"({peer_info['address']}:{peer_info['port']})"
+
+            if row["status"] != status:
+                row["status"] = status
+                row["status_indicator"].config(bg=status_color)
+                row["status_label"].config(text=status_text, fg=status_color)
+
+                # Move the peer within the sorted index (online first, then name)
+                self._unindex_peer_row(peer_username, row)
+                row["sort_key"] = (status != "online", row["name_key"])
+                bisect.insort(self._sorted_peers, (row["sort_key"], peer_username))
+            if row["address_label"].cget("text") != address_text:
+                row["address_label"].config(text=address_text)
+
+        # Only re-pack the rows when their order actually changed
+        order = [peer_username for _, peer_username in self._sorted_peers]
+        if order != self._peer_row_order:
+            self._peer_row_order = order
+            for row in self._peer_row_widgets.values():
+                row["frame"].pack_forget()
+            for peer_username in order:
+                self._peer_row_widgets[peer_username]["frame"].pack(
+                    fill=tk.X, pady=5, padx=3
+                )
+
+        if peers:
+            self._no_peers_label.pack_forget()
+        else:
+            self._no_peers_label.pack(pady=10)
+
+    def _unindex_peer_row(self, peer_username, row):
+        """Remove a peer's entry from the sorted index, if it has one"""
+        if row["sort_key"] is None:
+            return
+        entry = (row["sort_key"], peer_username)
+        index = bisect.bisect_left(self._sorted_peers, entry)
+        if index < len(self._sorted_peers) and self._sorted_peers[index] == entry:
+            del self._sorted_peers[index]
+        row["sort_key"] = None
+
+    def _create_peer_row(self, peer_username):
+        """Create the widgets for one row of the peers dialog"""
+        peer_frame = Frame(self._peers_frame, borderwidth=1, relief="groove")
+
+        status_indicator = Frame(peer_frame, width=10, height=10)
+        status_indicator.pack(side=tk.LEFT, padx=10, pady=10)
+
+        # Username and address
+        peer_label = Label(
+            peer_frame,
+            text=f"{peer_username}",
+            font=("Helvetica", 12, "bold"),
+        )
+        peer_label.pack(side=tk.LEFT, padx=5, pady=5)
+
+        address_label = Label(peer_frame, font=("Helvetica", 10), fg="gray")
+        address_label.pack(side=tk.LEFT, padx=5, pady=5)
+
+        # Status text
+        status_label = Label(peer_frame, font=("Helvetica", 10))
+        status_label.pack(side=tk.RIGHT, padx=10, pady=5)
+
+        return {
+            "frame": peer_frame,
+            "status_indicator": status_indicator,
+            "address_label": address_label,
+            "status_label": status_label,
+            "status": None,  # Filled in by _refresh_peers_window
+            "name_key": peer_username.lower(),
+            "sort_key": None,  # Position in self._sorted_peers
+        }
+
     def on_closing(self):
+        # Hide the window right away; leaving the network happens in the
+        # background and the app exits once it is done or the deadline passes
+        self.root.withdraw()
+        shutdown_thread = threading.Thread(target=self._shutdown)
+        shutdown_thread.daemon = True
+        shutdown_thread.start()
+        self.root.after(SHUTDOWN_DEADLINE_MS, self._finish_closing)
+
+    def _shutdown(self):
+        """Unregister from the presence server and leave the chat network."""
         # Unregister from presence server if registered
-        if (
-            self.presence_client
-            and hasattr(self.presence_client, "registered")
-            and self.presence_client.registered
-        ):
-            self.presence_client.unregister()
+        try:
+            if (
+                self.presence_client
+                and hasattr(self.presence_client, "registered")
+                and self.presence_client.registered
+            ):
+                self.presence_client.unregister()
+            if self.presence_client:
+                self.presence_client.close()
+        except Exception:
+            pass
+
+        # Let queued chat messages go out before leaving the network
+        self._send_executor.shutdown(wait=True)
 
         # Existing cleanup code
         if self.chat_instance:
@@ -829,11 +1075,21 @@ class ChatUI:
             except Exception:
                 pass
 
+        self.file_transfer.close()
+        try:
+            self.root.after(0, self._finish_closing)
+        except Exception:
+            pass  # The deadline already closed the window
+
+    def _finish_closing(self):
+        """Destroy the window and exit; runs on the Tk thread."""
         self.root.destroy()
         sys.exit(0)
 
 
 def main():
+    # Show the network modules' events, formatted like plain prints
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     root = tk.Tk()
     app = ChatUI(root)
     root.mainloop()
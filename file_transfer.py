@@ -4,16 +4,50 @@
 File transfer functionality for P2P Chat.
 
 This module handles sending and receiving files between peers by breaking
-them into chunks that can be sent as messages.
+them into chunks that can be sent as messages. Chunk data travels as the raw
+binary payload of each frame rather than inside the JSON header.
 """
 
 import os
+import mmap
+import logging
 import uuid
-import base64
-import socket
-from utils import send_message
+import time
+import queue
+import itertools
+import threading
+from utils import encode_header, ConnectionPool, FileRegion
 
-CHUNK_SIZE = 8192  # 8KB chunk size for file transfers
+# Transfer progress and dropped chunks; chat.py configures the output
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 256 * 1024  # 256KB initial chunk size for file transfers
+
+# Chunk size adapts between these bounds: it doubles while chunks are sent
+# faster than CHUNK_SEND_TARGET seconds and halves when sends take longer.
+MIN_CHUNK_SIZE = 16 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+CHUNK_SEND_TARGET = 0.05
+
+# Received chunks waiting to be written to disk; when the queue is full,
+# further chunks are refused and the connection delivering them is paused,
+# so a slow disk throttles that sender instead of filling memory.
+WRITE_QUEUE_SIZE = 32
+
+# Buffer size for files being received, so small chunks are gathered into
+# fewer, larger writes to disk
+FILE_WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Limits on incoming transfers, so a misbehaving peer cannot keep unlimited
+# files open or fill the disk; transfers that receive nothing for
+# TRANSFER_IDLE_TIMEOUT seconds are dropped.
+MAX_CONCURRENT_TRANSFERS = 16
+MAX_TRANSFER_BYTES = 2 << 30  # 2GB
+TRANSFER_IDLE_TIMEOUT = 60.0
+
+# Bytes a transfer must receive before the rest of its file is reserved on
+# disk, so transfers that stall after their first chunk reserve nothing
+RESERVE_AFTER_BYTES = 4 * 1024 * 1024
 
 
 class FileTransfer:
@@ -27,53 +61,194 @@ class FileTransfer:
     - Notify UI about transfer status
     """
 
-    def __init__(self, message_sender, downloads_folder="downloads", ui_callback=None):
+    def __init__(
+        self,
+        message_sender=None,
+        downloads_folder="downloads",
+        ui_callback=None,
+        chunk_size=CHUNK_SIZE,
+    ):
         """
         Initialize the FileTransfer system.
 
         Args:
-            message_sender: Function to send messages to peers
+            message_sender: Function to send messages to peers (defaults to
+                sending over this instance's persistent connections)
             downloads_folder: Directory to save received files
             ui_callback: Function to notify UI of transfer events
+            chunk_size: Size of the first chunk of each outgoing file; later
+                chunks adapt between MIN_CHUNK_SIZE and MAX_CHUNK_SIZE
         """
-        self.message_sender = message_sender
+        # Chunks to the same peer share one persistent connection, on which
+        # they are written with sendfile(2)
+        self._connections = ConnectionPool()
+        self.message_sender = message_sender or self._send_message_to_peer
         self.downloads_folder = downloads_folder
         self.ui_callback = ui_callback
+        self.chunk_size = chunk_size
+        # Transfer IDs are this instance's random node ID plus a counter, so
+        # a single random value is drawn per instance rather than per file
+        self._node_id = uuid.uuid4().hex[:16]
+        self._transfer_ids = itertools.count()
         # Create downloads directory if it doesn't exist
         os.makedirs(self.downloads_folder, exist_ok=True)
 
         # Dictionary to track incoming file transfers
-        # transfer_id -> {"filename": str, "data": bytearray(), "sender": str}
+        # transfer_id -> {"filename": str, "file": open file,
+        #                 "path": str (temporary file), "save_path": str,
+        #                 "sender": str, "size": int, "received": int,
+        #                 "reserved": bool, "last_active": float}
         self.incoming_transfers = {}
 
-    def send_file(self, file_path, target_addr=None):
+        # Received chunks are written to disk by a background thread so the
+        # network thread never blocks on file I/O
+        self._write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        writer_thread = threading.Thread(target=self._write_incoming_chunks)
+        writer_thread.daemon = True
+        writer_thread.start()
+
+    def send_file(self, file_path, target_addr=None, sender="Unknown"):
         """
         Send a file to a peer by breaking it into chunks.
 
+        The transfer stops at the first chunk that cannot be sent, and the
+        error is raised to the caller.
+
         Args:
             file_path: Path to the file to send
             target_addr: (host, port) of the recipient
-        """
-        if not os.path.isfile(file_path):
-            print(f"[FileTransfer] File not found: {file_path}")
-            return
+            sender: Username shown to the recipient as the file's sender
 
+        Raises:
+            OSError: If the file cannot be read or a chunk cannot be sent
+        """
         # Get just the filename (not full path)
         file_name = os.path.basename(file_path)
         # Generate a unique ID for this transfer
-        transfer_id = str(uuid.uuid4())
+        transfer_id = f"{self._node_id}-{next(self._transfer_ids)}"
 
-        # Read and send file in chunks
         with open(file_path, "rb") as f:
-            while True:
-                chunk = f.read(CHUNK_SIZE)
-                if not chunk:
-                    # Send an empty chunk to indicate end of file
-                    self._send_chunk(transfer_id, file_name, b"", True, target_addr)
-                    break
-                self._send_chunk(transfer_id, file_name, chunk, False, target_addr)
+            file_size = os.fstat(f.fileno()).st_size
+
+            mm = view = None
+            if not hasattr(os, "sendfile") and file_size:
+                # Without sendfile, map the file once and send memoryview
+                # windows of it, so no chunk is copied into bytes
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                view = memoryview(mm)
+
+            try:
+                offset = 0
+                chunk_size = self.chunk_size
+                while offset < file_size:
+                    count = min(chunk_size, file_size - offset)
+                    is_last = offset + count == file_size
+                    if view is None:
+                        # A region of the open file that the kernel copies to
+                        # the socket with sendfile(2)
+                        chunk = FileRegion(f, offset, count)
+                    else:
+                        chunk = view[offset : offset + count]
+
+                    started = time.monotonic()
+                    try:
+                        self._send_chunk(
+                            self._chunk_header(
+                                transfer_id,
+                                file_name,
+                                file_size,
+                                sender,
+                                offset,
+                                is_last,
+                            ),
+                            chunk,
+                            is_last,
+                            target_addr,
+                        )
+                    finally:
+                        if view is not None:
+                            chunk.release()
+                    elapsed = time.monotonic() - started
+
+                    offset += count
+                    chunk_size = self._next_chunk_size(chunk_size, elapsed)
+                    if offset < file_size and hasattr(os, "posix_fadvise"):
+                        # Have the kernel start reading the next chunk from
+                        # disk now, so the read overlaps with this send
+                        os.posix_fadvise(
+                            f.fileno(), offset, chunk_size, os.POSIX_FADV_WILLNEED
+                        )
+            finally:
+                if view is not None:
+                    view.release()
+                    mm.close()
+
+        # The final chunk marks the end of the file; an empty file still
+        # needs one (empty) chunk so the receiver creates it
+        if not file_size:
+            self._send_chunk(
+                self._chunk_header(transfer_id, file_name, 0, sender, 0, True),
+                b"",
+                True,
+                target_addr,
+            )
+
+    @staticmethod
+    def _next_chunk_size(chunk_size, elapsed):
+        """
+        Pick the size of the next chunk from how long the last one took.
+
+        Args:
+            chunk_size: Size of the chunk just sent
+            elapsed: Seconds spent sending it
+
+        Returns:
+            The chunk size to use next
+        """
+        if elapsed < CHUNK_SEND_TARGET:
+            return min(chunk_size * 2, MAX_CHUNK_SIZE)
+        return max(chunk_size // 2, MIN_CHUNK_SIZE)
 
     def handle_incoming_file_chunk(self, message):
+        """
+        Queue an incoming file chunk message to be written to disk.
+
+        Chunks are processed in arrival order by the writer thread. This never
+        blocks: when the writer is behind, the chunk is refused and the
+        caller offers it again later, holding back only that sender.
+
+        Args:
+            message: Dictionary containing file chunk data (see
+                _save_file_chunk for the fields)
+
+        Returns:
+            True if the chunk was queued, False if the queue is full
+        """
+        try:
+            self._write_queue.put_nowait(message)
+        except queue.Full:
+            return False
+        return True
+
+    def _write_incoming_chunks(self):
+        """Write queued file chunks to disk; runs on the writer thread."""
+        next_sweep = time.monotonic() + TRANSFER_IDLE_TIMEOUT
+        while True:
+            try:
+                self._save_file_chunk(
+                    self._write_queue.get(timeout=TRANSFER_IDLE_TIMEOUT)
+                )
+            except queue.Empty:
+                pass
+
+            # Transfers are only touched by this thread, so idle ones are
+            # swept here too
+            now = time.monotonic()
+            if now >= next_sweep:
+                self._drop_idle_transfers(now)
+                next_sweep = now + TRANSFER_IDLE_TIMEOUT
+
+    def _save_file_chunk(self, message):
         """
         Process an incoming file chunk message and save completed files.
 
@@ -82,112 +257,223 @@ class FileTransfer:
                 - type: "file_chunk"
                 - transfer_id: Unique ID for this transfer
                 - filename: Name of the file
-                - data: Base64-encoded chunk data
+                - data: Raw chunk bytes or bytearray (the frame's binary
+                  payload)
+                - size: Total size of the file in bytes
+                - offset: Position of this chunk in the file
                 - is_last: Boolean indicating if this is the last chunk
                 - sender: Username of sender
         """
         try:
             # Extract message fields
             transfer_id = message.get("transfer_id")
-            filename = message.get("filename")
-            encoded_data = message.get("data", "")
+            # The name comes from the peer; keep only its last component so
+            # it cannot point outside the downloads folder
+            filename = message.get("filename") or ""
+            filename = os.path.basename(filename.replace("\\", "/"))
+            data_chunk = message.get("data", b"")
+            file_size = message.get("size", 0)
+            offset = message.get("offset", 0)
             is_last = message.get("is_last", False)
-            sender = message.get("sender", "Unknown")  # Get sender's username
 
             # Validate required fields
-            if not transfer_id or not filename:
-                print("[FileTransfer] Invalid file chunk message")
+            if not transfer_id or filename in ("", ".", ".."):
+                logger.warning("Invalid file chunk message")
                 return
 
-            # Decode from base64 if it's a string
-            data_chunk = base64.b64decode(encoded_data) if encoded_data else b""
+            # Look the transfer up once per chunk; the first chunk creates it
+            transfer = self.incoming_transfers.get(transfer_id)
+            if transfer is None:
+                if offset:
+                    # The start of this transfer was lost or it was dropped
+                    return
+                # The sender's name is only needed when the transfer starts
+                sender = message.get("sender", "Unknown")
+                if len(self.incoming_transfers) >= MAX_CONCURRENT_TRANSFERS:
+                    logger.warning("Too many transfers, ignoring '%s'", filename)
+                    return
+                if file_size > MAX_TRANSFER_BYTES:
+                    logger.warning("File '%s' is too large, ignoring it", filename)
+                    return
 
-            # If this is the first chunk for this transfer, initialize entry
-            if transfer_id not in self.incoming_transfers:
-                self.incoming_transfers[transfer_id] = {
+                save_path = os.path.join(self.downloads_folder, filename)
+                # Each transfer writes to its own temporary file, which only
+                # replaces save_path once complete; a dropped transfer never
+                # touches an existing file or another transfer of the same name
+                part_path = f"{save_path}.{uuid.uuid4().hex[:8]}.part"
+                # Chunks are written to disk as they arrive instead of being
+                # buffered, so memory use does not grow with the file size
+                transfer = self.incoming_transfers[transfer_id] = {
                     "filename": filename,
-                    "data": bytearray(),
+                    "file": open(part_path, "xb", buffering=FILE_WRITE_BUFFER_SIZE),
+                    "path": part_path,
+                    "save_path": save_path,
                     "sender": sender,
+                    "size": file_size,
+                    "received": 0,
+                    "reserved": False,
+                    "last_active": time.monotonic(),
                 }
 
                 # Notify UI when starting to receive a file
                 if self.ui_callback:
                     self.ui_callback(f"Receiving file '{filename}' from {sender}...")
 
-            # Add this chunk to the accumulated file data
-            self.incoming_transfers[transfer_id]["data"].extend(data_chunk)
+            if offset != transfer["received"]:
+                # A chunk went missing, e.g. while the sender reconnected
+                self._abort_transfer(transfer_id)
+                if self.ui_callback:
+                    self.ui_callback(
+                        f"File '{filename}' from {transfer['sender']} is incomplete, transfer dropped"
+                    )
+                return
 
-            # If this is the last chunk, save the completed file
-            if is_last:
-                # Get the complete file data
-                file_data = self.incoming_transfers[transfer_id]["data"]
-                save_path = os.path.join(self.downloads_folder, filename)
+            transfer["received"] += len(data_chunk)
+            transfer["last_active"] = time.monotonic()
+            if transfer["received"] > MAX_TRANSFER_BYTES:
+                self._abort_transfer(transfer_id)
+                logger.warning("File '%s' is too large, transfer dropped", filename)
+                return
+
+            # Once the transfer is clearly progressing, reserve the rest of the
+            # file so the disk can lay it out in one piece instead of growing
+            # it chunk by chunk
+            if (
+                not transfer["reserved"]
+                and transfer["received"] >= RESERVE_AFTER_BYTES
+                and transfer["size"] > transfer["received"]
+                and hasattr(os, "posix_fallocate")
+            ):
+                transfer["reserved"] = True
+                try:
+                    os.posix_fallocate(transfer["file"].fileno(), 0, transfer["size"])
+                except OSError:
+                    pass  # Not supported by this filesystem
 
-                # Write to disk
-                with open(save_path, "wb") as f:
-                    f.write(file_data)
+            try:
+                transfer["file"].write(data_chunk)
+            except OSError:
+                self._abort_transfer(transfer_id)
+                raise
+
+            # If this is the last chunk, the file is complete
+            if is_last:
+                save_path = transfer["save_path"]
+                # Cut off any reserved space the sender did not fill
+                transfer["file"].truncate()
+                transfer["file"].close()
+                try:
+                    os.replace(transfer["path"], save_path)
+                except OSError:
+                    self._abort_transfer(transfer_id)
+                    raise
 
                 # Notify UI that file is complete
                 if self.ui_callback:
                     self.ui_callback(
-                        f"File '{filename}' received from {sender} and saved to {save_path}"
+                        f"File '{filename}' received from {transfer['sender']} and saved to {save_path}"
                     )
 
                 # Clean up the transfer
                 del self.incoming_transfers[transfer_id]
-                print(f"[FileTransfer] File '{filename}' saved to {save_path}")
+                logger.info("File '%s' saved to %s", filename, save_path)
         except Exception as e:
-            print(f"[FileTransfer] Error handling file chunk: {e}")
+            logger.error("Error handling file chunk: %s", e)
 
-    def _send_chunk(
-        self, transfer_id, filename, chunk, is_last_chunk, target_addr=None
-    ):
+    def _drop_idle_transfers(self, now):
+        """
+        Drop incoming transfers that have not received a chunk in a while.
+
+        Args:
+            now: Current time.monotonic() value
+        """
+        for transfer_id, transfer in list(self.incoming_transfers.items()):
+            if now - transfer["last_active"] > TRANSFER_IDLE_TIMEOUT:
+                self._abort_transfer(transfer_id)
+                logger.warning("Transfer of '%s' timed out", transfer["filename"])
+
+    def _abort_transfer(self, transfer_id):
         """
-        Create and send a file chunk message.
+        Drop an incoming transfer and delete its temporary file.
+
+        Args:
+            transfer_id: Unique ID of the transfer to drop
+        """
+        transfer = self.incoming_transfers.pop(transfer_id, None)
+        if transfer is not None:
+            try:
+                transfer["file"].close()
+            except OSError:
+                pass
+            try:
+                os.unlink(transfer["path"])
+            except OSError:
+                pass  # Already gone
+
+    @staticmethod
+    def _chunk_header(transfer_id, filename, file_size, sender, offset, is_last_chunk):
+        """
+        Build the encoded header for a file chunk message.
 
         Args:
             transfer_id: Unique ID for the transfer
             filename: Name of the file
-            chunk: Binary data to send
+            file_size: Total size of the file in bytes
+            sender: Username of the sender
+            offset: Position of the chunk in the file, which lets the
+                receiver detect a missing chunk
+            is_last_chunk: Boolean flag for the last chunk
+
+        Returns:
+            JSON header bytes; the chunk itself is sent as raw payload
+        """
+        return encode_header(
+            {
+                "type": "file_chunk",
+                "transfer_id": transfer_id,
+                "filename": filename,
+                "size": file_size,
+                "offset": offset,
+                "is_last": is_last_chunk,
+                "sender": sender,
+            }
+        )
+
+    def _send_chunk(self, header, chunk, is_last_chunk, target_addr=None):
+        """
+        Send a file chunk message.
+
+        Args:
+            header: Encoded chunk header from _chunk_header
+            chunk: Binary data (bytes, memoryview or FileRegion) to send
             is_last_chunk: Boolean flag for the last chunk
             target_addr: (host, port) of recipient
         """
-        # Encode binary data as base64 string
-        if isinstance(chunk, bytes):
-            chunk = base64.b64encode(chunk).decode("ascii")
-
-        # Create the message
-        message = {
-            "type": "file_chunk",
-            "transfer_id": transfer_id,
-            "filename": filename,
-            "data": chunk,
-            "is_last": is_last_chunk,
-            "sender": "You",  # This will be replaced by the receiver
-        }
-
-        # Send the message to the specified target
+        # Send the message to the specified target; every chunk but the last
+        # is flagged so the kernel can coalesce it with the next one
         if target_addr:
-            self.message_sender(target_addr, message)
+            self.message_sender(
+                target_addr, header, payload=chunk, more=not is_last_chunk
+            )
         else:
             # Example broadcast logic would go here
             pass
 
-    def _send_message_to_peer(self, peer_addr, message: dict):
+    def close(self):
+        """Close the persistent connections used to send file chunks."""
+        self._connections.close_all()
+
+    def _send_message_to_peer(self, peer_addr, message, payload=b"", more=False):
         """
-        Send a message to a specific peer.
+        Send a message to a specific peer over a persistent connection.
 
         Args:
             peer_addr: (host, port) tuple of the recipient
-            message: Dictionary containing the message
+            message: Dictionary containing the message, or encoded header bytes
+            payload: Raw bytes or FileRegion sent after the message header
+            more: True when another chunk follows right after this one
+
+        Raises:
+            OSError: If the message could not be sent
         """
-        host, port = peer_addr
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((host, port))
-            # Use the improved send_message function
-            send_message(sock, message)
-            sock.close()
-            print(f"Sent chunk of size {len(message.get('data', ''))} to {peer_addr}")
-        except Exception as e:
-            print(f"Error in _send_message_to_peer({peer_addr}): {e}")
+        self._connections.send(tuple(peer_addr), message, payload, more=more)
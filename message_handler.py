@@ -1,13 +1,26 @@
 # message_handler.py
 import time
 import socket
+import logging
 import json
-from utils import send_message
+from utils import send_message, open_connection
+
+logger = logging.getLogger(__name__)
 
 
 class MessageHandler:
     def __init__(self, chat):
         self.chat = chat
+        # Handler for each message type, looked up once per message; each is
+        # called as handler(client_socket, address, message, sender)
+        self._handlers = {
+            "join": self.handle_join,
+            "request_peers": self.handle_request_peers,
+            "chat": self.handle_chat,
+            "heartbeat": self.handle_heartbeat,
+            "leave": self.handle_leave,
+            "new_peer": self.handle_new_peer,
+        }
 
     def handle_message(
         self, client_socket: socket.socket, address: tuple, message: dict
@@ -15,40 +28,43 @@ class MessageHandler:
         message_type = message.get("type")
         sender = message.get("username")
 
-        if message_type == "join":
-            self.handle_join(client_socket, address, message, sender)
-        elif message_type == "request_peers":
-            self.handle_request_peers(client_socket)
-        elif message_type == "chat":
-            print(f"\n{sender}: {message['content']}")  # Clearer display with newline
-        elif message_type == "heartbeat":
-            self.handle_heartbeat(sender)
-        elif message_type == "leave":
-            self.handle_leave(sender)
-        elif message_type == "new_peer":
-            self.handle_new_peer(message)
-        else:
-            print(f"Unknown message type received from {sender}: {message_type}")
+        handler = self._handlers.get(message_type)
+        if handler is None:
+            logger.warning(
+                "Unknown message type received from %s: %s", sender, message_type
+            )
+            return
+        handler(client_socket, address, message, sender)
 
     def handle_join(
         self, client_socket: socket.socket, address: tuple, message: dict, sender: str
     ):
-        with self.chat.lock:
-            self.chat.peers[sender] = {
-                "address": address[0],
-                "port": message["port"],
-                "last_seen": time.time(),  # Initialize last_seen
+        self.chat.add_peers(
+            {
+                sender: {
+                    "address": address[0],
+                    "port": message["port"],
+                    "last_seen": time.time(),  # Initialize last_seen
+                }
             }
+        )
         send_message(
             client_socket,
             {"type": "welcome", "username": self.chat.username, "port": self.chat.port},
         )
-        print(f"\n{sender} joined the chat!")
+        logger.info("%s joined the chat!", sender)
 
         # Inform existing peers about the new peer
         self._broadcast_new_peer(sender, address[0], message["port"])
 
-    def handle_request_peers(self, client_socket: socket.socket):
+    def handle_chat(
+        self, client_socket: socket.socket, address: tuple, message: dict, sender: str
+    ):
+        logger.info("%s: %s", sender, message["content"])
+
+    def handle_request_peers(
+        self, client_socket: socket.socket, address: tuple, message: dict, sender: str
+    ):
         # Send the list of known peers back to the new peer
         peers_list = [
             {"username": peer, "address": info["address"], "port": info["port"]}
@@ -56,33 +72,45 @@ class MessageHandler:
         ]
         send_message(client_socket, {"type": "peer_list", "peers": peers_list})
 
-    def handle_heartbeat(self, sender: str):
-        with self.chat.lock:
-            if sender in self.chat.peers:
-                self.chat.peers[sender]["last_seen"] = time.time()
+    def handle_heartbeat(
+        self, client_socket: socket.socket, address: tuple, message: dict, sender: str
+    ):
+        # chat.peers is replaced rather than mutated, so the entry can be
+        # looked up without the lock
+        peer = self.chat.peers.get(sender)
+        if peer is not None:
+            peer["last_seen"] = time.time()
 
-    def handle_leave(self, sender: str):
-        with self.chat.lock:
-            if sender in self.chat.peers:
-                del self.chat.peers[sender]
-        print(f"\n{sender} left the chat.")
+    def handle_leave(
+        self, client_socket: socket.socket, address: tuple, message: dict, sender: str
+    ):
+        self.chat.remove_peer(sender)
+        logger.info("%s left the chat.", sender)
 
-    def handle_new_peer(self, message: dict):
+    def handle_new_peer(
+        self, client_socket: socket.socket, address: tuple, message: dict, sender: str
+    ):
         # Handle new peer information received from another peer
         new_peer_username = message["username"]
         new_peer_address = message["address"]
         new_peer_port = message["port"]
 
-        with self.chat.lock:
-            if new_peer_username not in self.chat.peers:
-                self.chat.peers[new_peer_username] = {
-                    "address": new_peer_address,
-                    "port": new_peer_port,
-                    "last_seen": time.time(),
+        if new_peer_username not in self.chat.peers:
+            self.chat.add_peers(
+                {
+                    new_peer_username: {
+                        "address": new_peer_address,
+                        "port": new_peer_port,
+                        "last_seen": time.time(),
+                    }
                 }
-                print(
-                    f"\nDiscovered new peer: {new_peer_username} ({new_peer_address}:{new_peer_port})"
-                )
+            )
+            logger.info(
+                "Discovered new peer: %s (%s:%s)",
+                new_peer_username,
+                new_peer_address,
+                new_peer_port,
+            )
 
     def _broadcast_new_peer(
         self, new_peer_username: str, new_peer_address: str, new_peer_port: int
@@ -95,16 +123,17 @@ class MessageHandler:
             "port": new_peer_port,
         }
 
-        with self.chat.lock:
-            peers_copy = self.chat.peers.copy()
-
-        for peer_username, peer_info in peers_copy.items():
+        # Iterate the current snapshot; chat.peers is never changed in place
+        for peer_username, peer_info in self.chat.peers.items():
             if peer_username != new_peer_username:  # Don't send to the new peer itself
                 try:
-                    peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    peer_socket.connect((peer_info["address"], peer_info["port"]))
+                    peer_socket = open_connection(
+                        (peer_info["address"], peer_info["port"])
+                    )
                     send_message(peer_socket, msg_data)
                     peer_socket.close()
                 except Exception as e:
-                    print(f"Error sending new peer info to {peer_username}: {e}")
+                    logger.warning(
+                        "Error sending new peer info to %s: %s", peer_username, e
+                    )
                     # Consider removing unreachable peer here, or let heartbeat handle it
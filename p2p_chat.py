@@ -10,12 +10,45 @@ peer connections through heartbeats.
 
 import sys
 import socket
-import json
 import time
 import random
+import selectors
 import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Callable
-from utils import send_message, receive_message
+from utils import (
+    send_message,
+    write_frame,
+    receive_message,
+    tune_socket,
+    send_datagram,
+    decode_datagram,
+    encode_header,
+    encode_message,
+    FrameBuffer,
+    ConnectionPool,
+    open_connection,
+)
+
+# Message types accepted over UDP; anything needing a reply stays on TCP
+DATAGRAM_TYPES = {"heartbeat"}
+
+# Seconds a reply written back to a connected peer may block before failing
+REPLY_TIMEOUT = 5.0
+
+# Most peers a broadcast sends to at the same time
+BROADCAST_WORKERS = 16
+
+# Longest disconnect() waits for queued chat messages to be written
+DISCONNECT_DRAIN_TIMEOUT = 2.0
+
+# Seconds between retries of messages held back on a paused connection
+PAUSED_RETRY_INTERVAL = 0.05
+
+# Most inbound connections kept open at once; further connections are closed
+# as soon as they are accepted, so a connection flood cannot exhaust memory
+MAX_CONNECTIONS = 256
 
 
 class P2PChat:
@@ -55,28 +88,75 @@ class P2PChat:
         self.port = port or random.randint(
             49152, 65535
         )  # Use random high port if not specified
-        self.peers: Dict[str, dict] = {}  # Stores info about connected peers
+        # Stores info about connected peers. Writers replace the whole dict
+        # under self.lock instead of changing it in place, so readers can
+        # iterate the current reference without taking the lock or copying.
+        self.peers: Dict[str, dict] = {}
+        # (peers snapshot, encoded peer_list reply built from it)
+        self._peer_list_cache = (None, b"")
         self.connected = True
         self.lock = threading.Lock()  # Thread safety for peer list access
         self.ui_callback = ui_callback
         self.status_callback = status_callback  # Callback for status changes
         self.file_chunk_callback = file_chunk_callback
+        # Sends to different peers run concurrently, so one slow peer does
+        # not delay the rest of a broadcast
+        self._send_executor = ThreadPoolExecutor(max_workers=BROADCAST_WORKERS)
+        # Chat messages and leave notices reuse one
+        # persistent connection per peer instead of connecting for each one
+        self._connections = ConnectionPool()
+        # Chat frames waiting to be written, per peer username. A peer has an
+        # entry only while a worker is draining it; frames queued meanwhile
+        # go out together in the worker's next write.
+        self._outbox: Dict[str, list] = {}
+        self._outbox_lock = threading.Lock()
+        # Notified whenever a peer's outbox is fully drained
+        self._outbox_drained = threading.Condition(self._outbox_lock)
+        # Handler for each message type, looked up once per message
+        self._message_handlers = {
+            "join": self._handle_join,
+            "chat": self._handle_chat,
+            "heartbeat": self._handle_heartbeat,
+            "leave": self._handle_leave,
+            "request_peers": self._handle_request_peers,
+            "file_chunk": self._handle_file_chunk,
+        }
 
         # Set up server socket to accept incoming connections
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Accepted connections inherit Nagle-off and the large receive buffer
+        tune_socket(self.server_socket)
+        # UDP socket on the same port number for small control datagrams
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
             self.server_socket.bind((self.host, self.port))
+            self.udp_socket.bind((self.host, self.port))
         except socket.error as e:
             self._notify_ui(f"Error binding socket: {e}. Exiting.")
             sys.exit(1)
-        self.server_socket.listen(5)
-
-        # Start the server thread to accept connections
+        # A full-size backlog absorbs bursts of connecting peers
+        self.server_socket.listen(socket.SOMAXCONN)
+
+        # A single selector watches the listener and every accepted connection
+        self.server_socket.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.server_socket, selectors.EVENT_READ)
+        # Connections taken out of the selector because a message they sent
+        # could not be accepted yet (socket -> connection state); only the
+        # selector thread touches this
+        self._paused_clients = {}
+
+        # Start the server thread to accept connections and read messages
         self.server_thread = threading.Thread(target=self._listen_for_connections)
         self.server_thread.daemon = True
         self.server_thread.start()
 
+        # Start the datagram thread to receive UDP control messages
+        self.datagram_thread = threading.Thread(target=self._listen_for_datagrams)
+        self.datagram_thread.daemon = True
+        self.datagram_thread.start()
+
         # Start the heartbeat thread to maintain peer connections
         self.heartbeat_thread = threading.Thread(target=self._send_heartbeat)
         self.heartbeat_thread.daemon = True
@@ -98,45 +178,149 @@ class P2PChat:
 
     def _listen_for_connections(self):
         """
-        Listen for and accept incoming peer connections in a background thread.
-        For each connection, start a new client handler thread.
+        Run the event loop for all incoming peer connections.
+
+        One background thread waits on the selector for the listening socket
+        and every accepted connection, so no thread is spawned per peer.
         """
-        while self.connected:
+        try:
+            while self.connected:
+                # Wake up often while connections are paused, to retry them
+                timeout = PAUSED_RETRY_INTERVAL if self._paused_clients else 1.0
+                try:
+                    events = self._selector.select(timeout=timeout)
+                except OSError as e:
+                    if self.connected:
+                        self._notify_ui(f"Error waiting for connections: {e}")
+                    break
+
+                for key, _ in events:
+                    if key.fileobj is self.server_socket:
+                        self._accept_connection()
+                    else:
+                        self._handle_client(key.fileobj, key.data)
+
+                for client_socket, state in list(self._paused_clients.items()):
+                    self._process_messages(client_socket, state)
+        finally:
+            for key in list(self._selector.get_map().values()):
+                if key.fileobj is not self.server_socket:
+                    key.fileobj.close()
+            for client_socket in self._paused_clients:
+                client_socket.close()
+            self._selector.close()
+
+    def _accept_connection(self):
+        """Accept every pending connection and register it with the selector."""
+        # Drain the whole accept queue per wakeup rather than one connection
+        # per pass through the event loop
+        while True:
             try:
                 client_socket, address = self.server_socket.accept()
-                client_handler = threading.Thread(
-                    target=self._handle_client, args=(client_socket, address)
-                )
-                client_handler.daemon = True
-                client_handler.start()
+            except BlockingIOError:
+                return  # No more pending connections
             except socket.error as e:
                 if self.connected:
                     self._notify_ui(f"Error accepting connection: {e}")
-            except Exception as e:
-                self._notify_ui(f"Unexpected error in _listen_for_connections: {e}")
+                return
+
+            # The selector map holds the listener plus every open connection
+            if len(self._selector.get_map()) > MAX_CONNECTIONS:
+                client_socket.close()
+                continue
 
-    def _handle_client(self, client_socket: socket.socket, address: tuple):
+            # Reads only happen once the selector reports data, so they never
+            # block; the timeout bounds replies written back on this socket
+            client_socket.settimeout(REPLY_TIMEOUT)
+            self._selector.register(
+                client_socket,
+                selectors.EVENT_READ,
+                (address, FrameBuffer(), deque()),
+            )
+
+    def _listen_for_datagrams(self):
+        """
+        Receive UDP control messages in a background thread.
+        Only message types listed in DATAGRAM_TYPES are processed.
+        """
+        while self.connected:
+            try:
+                data, address = self.udp_socket.recvfrom(65535)
+            except ConnectionResetError:
+                # Windows reports an ICMP port-unreachable for an earlier
+                # heartbeat this way; the TCP check handles offline peers
+                continue
+            except OSError as e:
+                if self.connected:
+                    self._notify_ui(f"Error receiving datagram: {e}")
+                continue
+
+            message = decode_datagram(data)
+            if message and message.get("type") in DATAGRAM_TYPES:
+                self._handle_message(None, address, message)
+
+    def _handle_client(self, client_socket: socket.socket, state: tuple):
         """
-        Handle communication with a connected client in a dedicated thread.
+        Read available data from a connected client and process its messages.
 
         Args:
-            client_socket: Socket connection to the client
-            address: Client's address as (ip, port) tuple
+            client_socket: Readable socket connection to the client
+            state: (address, FrameBuffer, pending messages) registered for
+                this connection
         """
+        address, frames, pending = state
         try:
-            while self.connected:
-                # Use the receive_message function to read framed message
-                message = receive_message(client_socket)
-                if not message:
-                    break  # Connection closed or error
+            # Read straight into the connection's reusable frame buffer
+            if not frames.recv(client_socket):
+                self._close_client(client_socket)  # Connection closed
+                return
+            pending.extend(frames.drain())
+        except (BlockingIOError, socket.timeout):
+            return  # Spurious wakeup, nothing to read yet
+        except Exception as e:
+            self._notify_ui(f"Error handling client {address}: {e}")
+            self._close_client(client_socket)
+            return
+
+        # Process every message completed by this read
+        self._process_messages(client_socket, state)
+
+    def _process_messages(self, client_socket: socket.socket, state: tuple):
+        """
+        Handle a connection's pending messages in order.
 
-                # Process the received message
-                self._handle_message(client_socket, address, message)
+        A message that cannot be accepted yet (a file chunk while the disk
+        writer is behind) stays queued and the connection stops being read
+        until it goes through, so only that sender is slowed down.
 
+        Args:
+            client_socket: Socket connection the messages arrived on
+            state: (address, FrameBuffer, pending messages) of the connection
+        """
+        address, _, pending = state
+        try:
+            while pending:
+                if self._handle_message(client_socket, address, pending[0]) is False:
+                    if client_socket not in self._paused_clients:
+                        self._selector.unregister(client_socket)
+                        self._paused_clients[client_socket] = state
+                    return
+                pending.popleft()
+
+            if self._paused_clients.pop(client_socket, None) is not None:
+                self._selector.register(client_socket, selectors.EVENT_READ, state)
         except Exception as e:
             self._notify_ui(f"Error handling client {address}: {e}")
-        finally:
-            client_socket.close()
+            self._close_client(client_socket)
+
+    def _close_client(self, client_socket: socket.socket):
+        """Stop watching a client connection and close it."""
+        self._paused_clients.pop(client_socket, None)
+        try:
+            self._selector.unregister(client_socket)
+        except (KeyError, ValueError):
+            pass  # Already unregistered
+        client_socket.close()
 
     def _handle_message(
         self, client_socket: socket.socket, address: tuple, message: dict
@@ -148,103 +332,212 @@ class P2PChat:
             client_socket: Socket connection to respond on if needed
             address: Sender's address as (ip, port) tuple
             message: The received message as a dictionary
+
+        Returns:
+            False if the message could not be accepted yet and should be
+            handled again later, otherwise None
         """
-        # Handle different message types with specific actions
-        if message["type"] == "join":
-            # New peer joining the network
-            with self.lock:
-                self.peers[message["username"]] = {
+        # Any message from a known peer shows it is alive, so only peers that
+        # have sent nothing recently need a heartbeat check. A leaving peer is
+        # about to be removed, so it is not marked online first.
+        if message["type"] != "leave":
+            self._mark_seen(message.get("username") or message.get("sender"))
+
+        # One dictionary lookup picks the handler for the message type
+        handler = self._message_handlers.get(message["type"], self._handle_unknown)
+        return handler(client_socket, address, message)
+
+    def _handle_unknown(
+        self, client_socket: socket.socket, address: tuple, message: dict
+    ):
+        """Message of a type this peer does not understand."""
+        self._notify_ui(f"Unknown message type: {message['type']} from {address}")
+
+    def _handle_join(self, client_socket: socket.socket, address: tuple, message: dict):
+        """New peer joining the network."""
+        self.add_peers(
+            {
+                message["username"]: {
                     "address": address[0],
                     "port": message["port"],
                     "last_seen": time.time(),
                     "status": "online",  # Set initial status
                 }
+            }
+        )
 
-            # Send welcome message back
-            send_message(
-                client_socket,
-                {"type": "welcome", "username": self.username, "port": self.port},
-            )
-            self._notify_ui(f"{message['username']} joined the network.")
+        # Send welcome message back
+        send_message(
+            client_socket,
+            {"type": "welcome", "username": self.username, "port": self.port},
+        )
+        self._notify_ui(f"{message['username']} joined the network.")
 
-            # Notify status callback of new online peer
-            if self.status_callback:
-                self.status_callback(message["username"], "online")
+        # Notify status callback of new online peer
+        if self.status_callback:
+            self.status_callback(message["username"], "online")
 
-        elif message["type"] == "chat":
-            # Regular chat message
-            self._notify_ui(f"{message['username']}: {message['content']}")
+    def _handle_chat(self, client_socket: socket.socket, address: tuple, message: dict):
+        """Regular chat message."""
+        self._notify_ui(f"{message['username']}: {message['content']}")
 
-        elif message["type"] == "heartbeat":
-            # Heartbeat to keep connections alive and detect online peers
-            with self.lock:
-                if message["username"] in self.peers:
-                    peer_info = self.peers[message["username"]]
-                    old_status = peer_info.get("status", "unknown")
-                    peer_info["last_seen"] = time.time()
-                    peer_info["status"] = "online"
-
-                    # Notify if status changed from offline to online
-                    if old_status != "online" and self.status_callback:
-                        self.status_callback(message["username"], "online")
+    def _handle_heartbeat(
+        self, client_socket: socket.socket, address: tuple, message: dict
+    ):
+        """Heartbeat to keep connections alive and detect online peers."""
+        # Nothing else to do: _handle_message already marked the peer as seen
 
-        elif message["type"] == "leave":
-            # Peer is leaving the network
-            with self.lock:
-                if message["username"] in self.peers:
-                    del self.peers[message["username"]]
-            self._notify_ui(f"{message['username']} left the network.")
+    def _mark_seen(self, peer_username: str):
+        """
+        Record that a known peer was just heard from.
 
-        elif message["type"] == "request_peers":
-            # Request for a list of known peers
-            with self.lock:
-                peers_list = [
-                    {"username": peer, "address": info["address"], "port": info["port"]}
-                    for peer, info in self.peers.items()
-                ]
-            send_message(client_socket, {"type": "peer_list", "peers": peers_list})
-
-        elif message["type"] == "file_chunk":
-            # File transfer chunk received
-            # Add sender information for the UI
-            if "sender" in message and message["sender"] == "You":
-                # Replace "You" with the actual sender's username
-                message["sender"] = message.get("username", "Unknown")
-            elif "sender" not in message:
-                message["sender"] = message.get("username", "Unknown")
-
-            # Forward to the file chunk handler
-            if self.file_chunk_callback:
-                self.file_chunk_callback(message)
-        else:
-            # Unknown message type
-            self._notify_ui(f"Unknown message type: {message['type']} from {address}")
+        Args:
+            peer_username: Username of the peer, ignored if not a known peer
+        """
+        # Look the peer up in the current snapshot without taking the lock;
+        # its entry is updated in place with single-key stores
+        peer_info = self.peers.get(peer_username)
+        if peer_info is None:
+            return
+        old_status = peer_info.get("status", "unknown")
+        peer_info["last_seen"] = time.time()
+        peer_info["status"] = "online"
+
+        # Notify if status changed from offline to online
+        if old_status != "online" and self.status_callback:
+            self.status_callback(peer_username, "online")
+
+    def _handle_leave(self, client_socket: socket.socket, address: tuple, message: dict):
+        """Peer is leaving the network."""
+        self.remove_peer(message["username"])
+        self._notify_ui(f"{message['username']} left the network.")
+
+    def _handle_request_peers(
+        self, client_socket: socket.socket, address: tuple, message: dict
+    ):
+        """Request for a list of known peers."""
+        # The encoded reply is cached against the peers snapshot it was built
+        # from; any join or leave swaps in a new snapshot and so invalidates it
+        peers = self.peers
+        cached_peers, peer_list = self._peer_list_cache
+        if cached_peers is not peers:
+            peers_list = [
+                {"username": peer, "address": info["address"], "port": info["port"]}
+                for peer, info in peers.items()
+            ]
+            peer_list = encode_header({"type": "peer_list", "peers": peers_list})
+            self._peer_list_cache = (peers, peer_list)
+        send_message(client_socket, peer_list)
+
+    def _handle_file_chunk(
+        self, client_socket: socket.socket, address: tuple, message: dict
+    ):
+        """File transfer chunk received."""
+        # Forward to the file chunk handler; the sender's name is already in
+        # the chunk header. The handler returns False when it cannot take the
+        # chunk yet.
+        if self.file_chunk_callback:
+            return self.file_chunk_callback(message)
 
     def broadcast_message(self, message: str):
         """
         Send a chat message to all connected peers.
 
+        The message is queued for each peer and written in the background,
+        so this returns without waiting on the network.
+
         Args:
             message: The text message to send
         """
-        msg_data = {"type": "chat", "username": self.username, "content": message}
+        # Encode once; every peer is sent the same frame bytes
+        frame = encode_message(
+            {"type": "chat", "username": self.username, "content": message}
+        )
 
-        with self.lock:
-            peers_copy = self.peers.copy()  # Make a copy to avoid concurrency issues
+        for peer_username, peer_info in self.peers.items():
+            self._queue_chat_frame(peer_username, peer_info, frame)
+
+    def _queue_chat_frame(self, peer_username: str, peer_info: dict, frame: bytes):
+        """
+        Queue a chat frame for a peer, starting a drain worker if none is running.
+
+        Args:
+            peer_username: Username of the recipient
+            peer_info: Peer entry with the recipient's address and port
+            frame: Complete encoded chat frame
+        """
+        with self._outbox_lock:
+            pending = self._outbox.get(peer_username)
+            if pending is not None:
+                pending.append(frame)  # The running worker will pick it up
+                return
 
-        # Send to each peer
-        for peer_username, peer_info in peers_copy.items():
+            # The worker waits for the lock, so it sees the entry added below
             try:
-                peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                peer_socket.connect((peer_info["address"], peer_info["port"]))
-                send_message(peer_socket, msg_data)
-                peer_socket.close()
+                self._send_executor.submit(
+                    self._send_chat_to_peer, peer_username, peer_info
+                )
+            except RuntimeError:
+                return  # Executor shut down by disconnect()
+            self._outbox[peer_username] = [frame]
+
+    def _send_chat_to_peer(self, peer_username: str, peer_info: dict):
+        """
+        Write a peer's queued chat frames until none are left.
+
+        Frames queued while a write is in progress are joined into a single
+        write, so a burst of messages costs one send per peer rather than one
+        per message. The peer is dropped if it is unreachable.
+
+        Args:
+            peer_username: Username of the recipient
+            peer_info: Peer entry with the recipient's address and port
+        """
+        peer_addr = (peer_info["address"], peer_info["port"])
+        while True:
+            with self._outbox_lock:
+                frames = self._outbox[peer_username]
+                if not frames:
+                    del self._outbox[peer_username]
+                    self._outbox_drained.notify_all()
+                    return
+                self._outbox[peer_username] = []
+
+            try:
+                self._connections.send_frames(peer_addr, b"".join(frames))
             except Exception as e:
+                with self._outbox_lock:
+                    del self._outbox[peer_username]
+                    self._outbox_drained.notify_all()
                 self._notify_ui(f"Error sending message to {peer_username}: {e}")
                 # Remove unreachable peer
-                with self.lock:
-                    if peer_username in self.peers:
-                        del self.peers[peer_username]
+                self.remove_peer(peer_username)
+                return
+
+    def add_peers(self, new_peers: dict):
+        """
+        Add or replace peers by swapping in an updated copy of self.peers.
+
+        Args:
+            new_peers: Dictionary of username -> peer info to add
+        """
+        with self.lock:
+            peers = dict(self.peers)
+            peers.update(new_peers)
+            self.peers = peers
+
+    def remove_peer(self, peer_username: str):
+        """
+        Remove a peer by swapping in a copy of self.peers without it.
+
+        Args:
+            peer_username: Username of the peer to remove
+        """
+        with self.lock:
+            if peer_username in self.peers:
+                peers = dict(self.peers)
+                del peers[peer_username]
+                self.peers = peers
 
     def join_network(self, known_host: str, known_port: int):
         """
@@ -259,8 +552,7 @@ class P2PChat:
         """
         try:
             # Connect to the known peer
-            peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            peer_socket.connect((known_host, known_port))
+            peer_socket = open_connection((known_host, known_port))
 
             # Send join request with our username and port
             send_message(
@@ -272,13 +564,16 @@ class P2PChat:
             message = receive_message(peer_socket)
             if message and message.get("type") == "welcome":
                 # Add the peer to our list
-                with self.lock:
-                    self.peers[message["username"]] = {
-                        "address": known_host,
-                        "port": message["port"],
-                        "last_seen": time.time(),
-                        "status": "online",
+                self.add_peers(
+                    {
+                        message["username"]: {
+                            "address": known_host,
+                            "port": message["port"],
+                            "last_seen": time.time(),
+                            "status": "online",
+                        }
                     }
+                )
                 self._notify_ui(
                     f"Successfully joined the network through {message['username']}."
                 )
@@ -289,15 +584,18 @@ class P2PChat:
                 # Receive and process peer list
                 peer_list_msg = receive_message(peer_socket)
                 if peer_list_msg and peer_list_msg.get("type") == "peer_list":
-                    with self.lock:
-                        for peer in peer_list_msg["peers"]:
-                            if peer["username"] != self.username:
-                                self.peers[peer["username"]] = {
-                                    "address": peer["address"],
-                                    "port": peer["port"],
-                                    "last_seen": time.time(),
-                                    "status": "online",
-                                }
+                    self.add_peers(
+                        {
+                            peer["username"]: {
+                                "address": peer["address"],
+                                "port": peer["port"],
+                                "last_seen": time.time(),
+                                "status": "online",
+                            }
+                            for peer in peer_list_msg["peers"]
+                            if peer["username"] != self.username
+                        }
+                    )
                     self._notify_ui(
                         f"Received list of existing peers: {len(peer_list_msg['peers'])} peers found."
                     )
@@ -324,59 +622,110 @@ class P2PChat:
         1. Sending heartbeats to peers periodically
         2. Detecting when peers go offline
         3. Updating status information
+
+        Heartbeats go out as UDP datagrams, which keep each peer's view of us
+        fresh without a TCP handshake. Peers we have not heard from recently
+        are also sent a heartbeat over a new TCP connection, to confirm they
+        are alive.
         """
+        # The heartbeat is the same for every peer and every round, so it is
+        # encoded once and the bytes are sent to each peer in turn
+        heartbeat = encode_header({"type": "heartbeat", "username": self.username})
+
         while self.connected:
             current_time = time.time()
 
-            with self.lock:
-                peers_copy = self.peers.copy()  # Copy to avoid concurrent modification
-
             # Check each peer
-            for peer_username, peer_info in peers_copy.items():
+            quiet_peers = []
+            for peer_username, peer_info in self.peers.items():
                 try:
-                    # Check if peer might be offline (no heartbeat for 15 seconds)
-                    if current_time - peer_info.get("last_seen", 0) > 15:
-                        old_status = peer_info.get("status", "unknown")
-
-                        # Try to connect
-                        peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                        peer_socket.settimeout(5)
-                        peer_socket.connect((peer_info["address"], peer_info["port"]))
-                        send_message(
-                            peer_socket,
-                            {"type": "heartbeat", "username": self.username},
-                        )
-                        peer_socket.close()
-
-                        # Update last seen and ensure status is online
-                        with self.lock:
-                            if peer_username in self.peers:
-                                self.peers[peer_username]["last_seen"] = time.time()
-                                self.peers[peer_username]["status"] = "online"
-
-                                # Notify if status changed
-                                if old_status != "online" and self.status_callback:
-                                    self.status_callback(peer_username, "online")
-
-                except Exception:
-                    # Connection failed - mark as offline
-                    with self.lock:
-                        if peer_username in self.peers:
-                            old_status = self.peers[peer_username].get(
-                                "status", "unknown"
-                            )
-                            self.peers[peer_username]["status"] = "offline"
-
-                            # Notify UI and status callback
-                            if old_status != "offline":
-                                self._notify_ui(
-                                    f"{peer_username} appears to be offline."
-                                )
-                                if self.status_callback:
-                                    self.status_callback(peer_username, "offline")
+                    send_datagram(
+                        self.udp_socket,
+                        (peer_info["address"], peer_info["port"]),
+                        heartbeat,
+                    )
+                except OSError:
+                    pass  # The TCP check below decides whether the peer is offline
+
+                # Check if peer might be offline (no heartbeat for 15 seconds)
+                if current_time - peer_info.get("last_seen", 0) > 15:
+                    quiet_peers.append((peer_username, peer_info))
+
+            # Check quiet peers concurrently, so one unreachable peer's
+            # connect timeout does not delay the checks of the others
+            try:
+                futures = [
+                    self._send_executor.submit(
+                        self._check_peer, peer_username, peer_info, heartbeat
+                    )
+                    for peer_username, peer_info in quiet_peers
+                ]
+            except RuntimeError:
+                break  # Executor shut down by disconnect()
+            for future in futures:
+                future.result()
 
             time.sleep(10)  # Check every 10 seconds
 
+    def _check_peer(self, peer_username: str, peer_info: dict, heartbeat: bytes):
+        """
+        Confirm a quiet peer is alive over TCP and update its status.
+
+        The check opens a new connection with a bounded connect time rather
+        than writing to the pooled one: a write to a host that vanished
+        without closing the connection still succeeds, as the data just
+        waits in the kernel send buffer.
+
+        Args:
+            peer_username: Username of the peer to check
+            peer_info: Peer entry with the peer's address and port
+            heartbeat: Encoded heartbeat message header to send
+        """
+        old_status = peer_info.get("status", "unknown")
+        try:
+            # Try to connect to the peer
+            with open_connection((peer_info["address"], peer_info["port"])) as sock:
+                write_frame(sock, heartbeat)
+
+        except Exception:
+            # Connection failed - mark as offline
+            old_status = "offline"
+            with self.lock:
+                if peer_username in self.peers:
+                    old_status = self.peers[peer_username].get("status", "unknown")
+                    self.peers[peer_username]["status"] = "offline"
+
+            # Notify UI and status callback
+            if old_status != "offline":
+                self._notify_ui(f"{peer_username} appears to be offline.")
+                if self.status_callback:
+                    self.status_callback(peer_username, "offline")
+            return
+
+        # Update last seen and ensure status is online
+        with self.lock:
+            known = peer_username in self.peers
+            if known:
+                self.peers[peer_username]["last_seen"] = time.time()
+                self.peers[peer_username]["status"] = "online"
+
+        # Notify if status changed
+        if known and old_status != "online" and self.status_callback:
+            self.status_callback(peer_username, "online")
+
+    def _send_leave(self, peer_info: dict, leave: bytes):
+        """
+        Tell one peer that we are leaving, ignoring any error.
+
+        Args:
+            peer_info: Peer entry with the recipient's address and port
+            leave: Encoded leave message header
+        """
+        try:
+            self._connections.send((peer_info["address"], peer_info["port"]), leave)
+        except Exception:
+            pass  # Ignore errors on disconnect
+
     def get_online_peers(self):
         """
         Get dictionary of currently online peers.
@@ -384,12 +733,11 @@ class P2PChat:
         Returns:
             dict: Filtered dictionary containing only online peers
         """
-        with self.lock:
-            return {
-                username: info
-                for username, info in self.peers.items()
-                if info.get("status") == "online"
-            }
+        return {
+            username: info
+            for username, info in self.peers.items()
+            if info.get("status") == "online"
+        }
 
     def disconnect(self):
         """
@@ -402,18 +750,24 @@ class P2PChat:
         """
         self.connected = False  # Signal threads to stop
 
-        # Notify peers that we're leaving
-        with self.lock:
-            peers_copy = self.peers.copy()
+        # Let queued chat messages go out before the leave notices
+        with self._outbox_lock:
+            self._outbox_drained.wait_for(
+                lambda: not self._outbox, timeout=DISCONNECT_DRAIN_TIMEOUT
+            )
 
-        for peer_username, peer_info in peers_copy.items():
-            try:
-                peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                peer_socket.connect((peer_info["address"], peer_info["port"]))
-                send_message(peer_socket, {"type": "leave", "username": self.username})
-                peer_socket.close()
-            except Exception:
-                pass  # Ignore errors on disconnect
+        # Notify peers that we're leaving,
+        # concurrently, so an unreachable peer does not hold up the others
+        leave = encode_header({"type": "leave", "username": self.username})
+        futures = [
+            self._send_executor.submit(self._send_leave, peer_info, leave)
+            for peer_info in self.peers.values()
+        ]
+        for future in futures:
+            future.result()
+
+        self._send_executor.shutdown(wait=False)
+        self._connections.close_all()
 
         # Close the server socket
         try:
@@ -422,3 +776,4 @@ class P2PChat:
             pass  # Socket might already be closed
         finally:
             self.server_socket.close()
+            self.udp_socket.close()
@@ -1,7 +1,7 @@
 # peer_status_tracker.py
 
 import time
-from typing import Dict, Callable, Optional
+from typing import Dict, Set, Callable, Optional
 
 
 class PeerStatusTracker:
@@ -12,6 +12,9 @@ class PeerStatusTracker:
     def __init__(self, status_change_callback: Optional[Callable] = None):
         # Dictionary to store peer status: username -> {"status": "online"|"offline", "last_updated": timestamp}
         self.peers: Dict[str, dict] = {}
+        # Index of usernames by status, kept in step with self.peers so the
+        # online/offline queries do not scan every peer
+        self._by_status: Dict[str, Set[str]] = {"online": set(), "offline": set()}
         self.status_change_callback = status_change_callback
 
     def update_peer_status(self, username: str, status: str):
@@ -19,6 +22,7 @@ class PeerStatusTracker:
         current_time = time.time()
 
         # Check if this is a status change
+        old_status = None
         if username in self.peers:
             old_status = self.peers[username].get("status")
             if old_status != status:
@@ -30,8 +34,11 @@ class PeerStatusTracker:
             if self.status_change_callback:
                 self.status_change_callback(username, status, None)
 
-        # Update the status
+        # Update the status and move the peer to its new index set
         self.peers[username] = {"status": status, "last_updated": current_time}
+        if old_status != status:
+            self._by_status.get(old_status, set()).discard(username)
+            self._by_status.setdefault(status, set()).add(username)
 
     def get_peer_status(self, username: str) -> str:
         """Get a peer's current status"""
@@ -46,15 +53,11 @@ class PeerStatusTracker:
     def get_online_peers(self) -> Dict[str, dict]:
         """Get all online peers"""
         return {
-            username: info
-            for username, info in self.peers.items()
-            if info.get("status") == "online"
+            username: self.peers[username] for username in self._by_status["online"]
         }
 
     def get_offline_peers(self) -> Dict[str, dict]:
         """Get all offline peers"""
         return {
-            username: info
-            for username, info in self.peers.items()
-            if info.get("status") == "offline"
+            username: self.peers[username] for username in self._by_status["offline"]
         }
@@ -1,9 +1,21 @@
 # presence_client.py
 
-import socket
+import logging
 import threading
 import time
-from utils import send_message, receive_message
+from utils import (
+    write_frame,
+    receive_message,
+    open_connection,
+    is_connection_alive,
+    encode_header,
+)
+
+# Presence server errors; a lost server logs one warning per heartbeat
+logger = logging.getLogger(__name__)
+
+# Seconds an online-users list from the presence server is reused
+ONLINE_USERS_CACHE_TTL = 5.0
 
 
 class PresenceClient:
@@ -17,33 +29,36 @@ class PresenceClient:
         self.registered = False
         self.heartbeat_thread = None
         self.running = False
+        # One connection to the presence server is kept open and shared by
+        # all requests; the lock keeps request/response pairs together
+        self._sock = None
+        self._sock_lock = threading.Lock()
+        # (time fetched, users) of the last online-users reply
+        self._online_users_cache = (0.0, [])
 
     def register(self):
         """Register with the presence server"""
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.presence_server, self.presence_port))
-
-            # Get the local IP address that can be used by other peers
-            # This is a simple approach - in a real-world scenario you might
-            # need more sophisticated methods to get the correct external IP
-            local_ip = sock.getsockname()[0]
-            if local_ip == "0.0.0.0":
-                local_ip = "127.0.0.1"  # Fallback to localhost
-
-            send_message(
-                sock,
+            with self._sock_lock:
+                sock = self._connect()
+
+                # Get the local IP address that can be used by other peers
+                # This is a simple approach - in a real-world scenario you might
+                # need more sophisticated methods to get the correct external IP
+                local_ip = sock.getsockname()[0]
+                if local_ip == "0.0.0.0":
+                    local_ip = "127.0.0.1"  # Fallback to localhost
+
+            response = self._request(
                 {
                     "type": "register",
                     "username": self.username,
                     "port": self.port,
                     "address": local_ip,
                 },
+                expect_reply=True,
             )
 
-            response = receive_message(sock)
-            sock.close()
-
             if response and response.get("success"):
                 self.registered = True
                 self.running = True
@@ -60,11 +75,11 @@ class PresenceClient:
                     if response
                     else "No response"
                 )
-                print(f"Registration failed: {reason}")
+                logger.warning("Registration failed: %s", reason)
                 return False
 
         except Exception as e:
-            print(f"Error registering with presence server: {e}")
+            logger.error("Error registering with presence server: %s", e)
             return False
 
     def unregister(self):
@@ -75,54 +90,120 @@ class PresenceClient:
             return
 
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.presence_server, self.presence_port))
-
-            send_message(sock, {"type": "unregister", "username": self.username})
+            self._request({"type": "unregister", "username": self.username})
 
-            sock.close()
             self.registered = False
-            print("Unregistered from presence server")
+            logger.info("Unregistered from presence server")
 
         except Exception as e:
-            print(f"Error unregistering from presence server: {e}")
+            logger.error("Error unregistering from presence server: %s", e)
 
-    def get_online_users(self):
-        """Get list of online users from the presence server"""
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.presence_server, self.presence_port))
+    def close(self):
+        """Close the connection to the presence server"""
+        with self._sock_lock:
+            self._close_socket()
+
+    def get_online_users(self, force=False):
+        """
+        Get list of online users from the presence server.
 
-            send_message(sock, {"type": "query"})
+        A list fetched less than ONLINE_USERS_CACHE_TTL seconds ago is
+        returned without contacting the server.
 
-            response = receive_message(sock)
-            sock.close()
+        Args:
+            force: Always query the server, e.g. on an explicit refresh
+        """
+        if not force:
+            users = self.cached_online_users()
+            if users is not None:
+                return users
+
+        try:
+            response = self._request({"type": "query"}, expect_reply=True)
 
             if response and response.get("type") == "online_users":
                 # Filter out ourselves from the list
-                return [
+                users = [
                     user
                     for user in response.get("users", [])
                     if user.get("username") != self.username
                 ]
+                self._online_users_cache = (time.time(), users)
+                return users
 
             return []
 
         except Exception as e:
-            print(f"Error querying online users: {e}")
+            logger.error("Error querying online users: %s", e)
             return []
 
+    def cached_online_users(self):
+        """Return the cached online-users list, or None if it has expired"""
+        fetched_at, users = self._online_users_cache
+        if time.time() - fetched_at < ONLINE_USERS_CACHE_TTL:
+            return users
+        return None
+
     def _send_heartbeats(self):
         """Send periodic heartbeats to the presence server"""
+        # Every heartbeat is identical, so it is encoded once
+        heartbeat = encode_header({"type": "heartbeat", "username": self.username})
         while self.running:
             try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((self.presence_server, self.presence_port))
-
-                send_message(sock, {"type": "heartbeat", "username": self.username})
-
-                sock.close()
+                self._request(heartbeat)
             except Exception as e:
-                print(f"Error sending heartbeat: {e}")
+                logger.warning("Error sending heartbeat: %s", e)
 
             time.sleep(20)  # Send heartbeat every 20 seconds
+
+    def _request(self, message, expect_reply=False):
+        """
+        Send a message over the shared connection, reconnecting if needed.
+
+        The server may have closed an idle connection (or only handle one
+        request per connection), so a failed exchange is retried once on a
+        fresh connection.
+
+        Args:
+            message: Dictionary containing the request, or encoded header
+                bytes from encode_header
+            expect_reply: Whether to wait for and return the server's response
+
+        Returns:
+            The response message, or None if no reply was expected
+        """
+        with self._sock_lock:
+            for attempt in range(2):
+                sock = self._connect()
+                try:
+                    write_frame(sock, message)
+                    if not expect_reply:
+                        return None
+                    response = receive_message(sock)
+                    if response is not None:
+                        return response
+                except OSError:
+                    if attempt:
+                        self._close_socket()
+                        raise
+                self._close_socket()
+            return None
+
+    def _connect(self):
+        """Return the shared connection, opening a new one if it is missing or dead."""
+        if self._sock is not None and is_connection_alive(self._sock):
+            return self._sock
+
+        self._close_socket()
+        sock = open_connection((self.presence_server, self.presence_port))
+        self._sock = sock
+        return sock
+
+    def _close_socket(self):
+        """Close and forget the shared connection, if any."""
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
@@ -7,11 +7,26 @@ This server tracks which users are online and allows users to discover
 each other without needing to know IP addresses and ports in advance.
 """
 
+import heapq
+import logging
 import socket
+import selectors
 import threading
-import json
 import time
-from utils import send_message, receive_message
+from utils import send_message, tune_socket, encode_header, FrameBuffer
+
+# Server events are logged; start_presence_server.py shows INFO and above
+logger = logging.getLogger(__name__)
+
+# Seconds a client connection may stay idle between requests before it is
+# closed; clients keep one connection open and heartbeat every 20 seconds.
+CLIENT_IDLE_TIMEOUT = 60.0
+
+# Seconds a reply written back to a client may block before failing
+REPLY_TIMEOUT = 5.0
+
+# Seconds without a heartbeat after which a user is considered offline
+USER_STALE_TIMEOUT = 60.0
 
 
 class PresenceServer:
@@ -37,7 +52,15 @@ class PresenceServer:
         self.running = False
         self.server_socket = None
         self.online_users = {}  # username -> {address, port, last_seen}
+        # Encoded online_users reply, rebuilt only after a user is added,
+        # changed or removed; heartbeats do not touch it
+        self._online_users_reply = None
         self.lock = threading.Lock()
+        self._selector = None
+        # Min-heap of (expiry time, username, last_seen) for stale-user
+        # cleanup; an entry is outdated once the user's last_seen moves on
+        self._expiry_heap = []
+        self._cleanup_wakeup = threading.Event()
 
     def start(self):
         """
@@ -47,44 +70,66 @@ class PresenceServer:
         1. Binds to the specified host and port
         2. Starts a cleanup thread to remove stale users
         3. Accepts and processes client connections
+
+        A single selector loop serves the listening socket and every client
+        connection, so no thread is started per client.
         """
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Accepted connections inherit Nagle-off and keepalive
+        tune_socket(self.server_socket)
 
         try:
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.server_socket.listen(socket.SOMAXCONN)
+            self.server_socket.setblocking(False)
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.server_socket, selectors.EVENT_READ)
             self.running = True
 
-            print(f"Presence server running on {self.host}:{self.port}")
+            logger.info("Presence server running on %s:%s", self.host, self.port)
 
             # Start a thread to clean up stale users
             cleanup_thread = threading.Thread(target=self._cleanup_stale_users)
             cleanup_thread.daemon = True
             cleanup_thread.start()
 
-            # Accept client connections
+            # Accept client connections and serve their requests
+            next_idle_check = time.time() + 1.0
             while self.running:
                 try:
-                    client_socket, address = self.server_socket.accept()
-                    client_thread = threading.Thread(
-                        target=self._handle_client, args=(client_socket, address)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
-                except Exception as e:
+                    events = self._selector.select(timeout=1.0)
+                except OSError as e:
                     if self.running:
-                        print(f"Error accepting connection: {e}")
+                        logger.error("Error waiting for connections: %s", e)
+                    break
+
+                for key, _ in events:
+                    if key.fileobj is self.server_socket:
+                        self._accept_clients()
+                    else:
+                        self._handle_client(key.fileobj, key.data)
+
+                # Look for idle clients about once a second, not on every event
+                if time.time() >= next_idle_check:
+                    self._close_idle_clients()
+                    next_idle_check = time.time() + 1.0
 
         except Exception as e:
-            print(f"Error starting presence server: {e}")
+            logger.error("Error starting presence server: %s", e)
         finally:
+            if self._selector:
+                for key in list(self._selector.get_map().values()):
+                    if key.fileobj is not self.server_socket:
+                        key.fileobj.close()
+                self._selector.close()
             if self.server_socket:
                 self.server_socket.close()
 
     def stop(self):
         """Stop the presence server and clean up resources."""
         self.running = False
+        self._cleanup_wakeup.set()
         if self.server_socket:
             try:
                 self.server_socket.shutdown(socket.SHUT_RDWR)
@@ -92,34 +137,78 @@ class PresenceServer:
             except Exception:
                 pass  # Socket might already be closed
 
-    def _handle_client(self, client_socket, address):
+    def _accept_clients(self):
+        """Accept every pending connection and register it with the selector."""
+        while True:
+            try:
+                client_socket, address = self.server_socket.accept()
+            except BlockingIOError:
+                return  # No more pending connections
+            except OSError as e:
+                if self.running:
+                    logger.error("Error accepting connection: %s", e)
+                return
+
+            # Reads only happen once the selector reports data; the timeout
+            # bounds replies written back on this socket
+            client_socket.settimeout(REPLY_TIMEOUT)
+            self._selector.register(
+                client_socket,
+                selectors.EVENT_READ,
+                {"address": address, "frames": FrameBuffer(), "last_active": time.time()},
+            )
+
+    def _close_client(self, client_socket):
+        """Stop watching a client connection and close it."""
+        try:
+            self._selector.unregister(client_socket)
+        except (KeyError, ValueError):
+            pass  # Already unregistered
+        client_socket.close()
+
+    def _close_idle_clients(self):
+        """Close client connections that have sent nothing for too long."""
+        current_time = time.time()
+        for key in list(self._selector.get_map().values()):
+            if key.fileobj is self.server_socket:
+                continue
+            if current_time - key.data["last_active"] > CLIENT_IDLE_TIMEOUT:
+                self._close_client(key.fileobj)
+
+    def _handle_client(self, client_socket, state):
         """
-        Handle a client request.
+        Read available data from a client and process its requests.
+
+        Clients keep their connection open, so several requests can arrive
+        on the same socket.
 
         Args:
-            client_socket: Socket connected to the client
-            address: Client's address as (ip, port) tuple
+            client_socket: Readable socket connected to the client
+            state: Connection state registered with the selector
         """
         try:
-            message = receive_message(client_socket)
-            if not message:
+            if not state["frames"].recv(client_socket):
+                self._close_client(client_socket)  # Connection closed
                 return
-
-            msg_type = message.get("type")
-
-            # Process different request types
-            if msg_type == "register":
-                self._register_user(message, client_socket)
-            elif msg_type == "query":
-                self._send_online_users(client_socket)
-            elif msg_type == "heartbeat":
-                self._update_user_heartbeat(message)
-            elif msg_type == "unregister":
-                self._unregister_user(message)
+            state["last_active"] = time.time()
+
+            for message in state["frames"].drain():
+                msg_type = message.get("type")
+
+                # Process different request types
+                if msg_type == "register":
+                    self._register_user(message, client_socket)
+                elif msg_type == "query":
+                    self._send_online_users(client_socket)
+                elif msg_type == "heartbeat":
+                    self._update_user_heartbeat(message)
+                elif msg_type == "unregister":
+                    self._unregister_user(message)
+        except (BlockingIOError, socket.timeout):
+            pass  # Spurious wakeup, nothing to read yet
         except Exception as e:
-            print(f"Error handling client: {e}")
-        finally:
-            client_socket.close()
+            logger.warning("Error handling client: %s", e)
+            self._close_client(client_socket)
 
     def _register_user(self, message, client_socket):
         """
@@ -147,24 +236,36 @@ class PresenceServer:
 
         # Store user information
         with self.lock:
+            last_seen = time.time()
             self.online_users[username] = {
                 "address": client_ip,
                 "port": user_port,
-                "last_seen": time.time(),
+                "last_seen": last_seen,
             }
+            self._online_users_reply = None
+            self._schedule_expiry(username, last_seen)
 
         send_message(client_socket, {"type": "register_response", "success": True})
-        print(f"Registered user: {username} at {client_ip}:{user_port}")
+        logger.info("Registered user: %s at %s:%s", username, client_ip, user_port)
 
     def _send_online_users(self, client_socket):
         """Send list of online users to client"""
         with self.lock:
-            user_list = [
-                {"username": username, "address": data["address"], "port": data["port"]}
-                for username, data in self.online_users.items()
-            ]
-
-        send_message(client_socket, {"type": "online_users", "users": user_list})
+            reply = self._online_users_reply
+            if reply is None:
+                user_list = [
+                    {
+                        "username": username,
+                        "address": data["address"],
+                        "port": data["port"],
+                    }
+                    for username, data in self.online_users.items()
+                ]
+                reply = self._online_users_reply = encode_header(
+                    {"type": "online_users", "users": user_list}
+                )
+
+        send_message(client_socket, reply)
 
     def _update_user_heartbeat(self, message):
         """Update user's last_seen timestamp"""
@@ -173,7 +274,9 @@ class PresenceServer:
         if username:
             with self.lock:
                 if username in self.online_users:
-                    self.online_users[username]["last_seen"] = time.time()
+                    last_seen = time.time()
+                    self.online_users[username]["last_seen"] = last_seen
+                    self._schedule_expiry(username, last_seen)
 
     def _unregister_user(self, message):
         """Remove user from online list"""
@@ -183,32 +286,51 @@ class PresenceServer:
             with self.lock:
                 if username in self.online_users:
                     del self.online_users[username]
-                    print(f"Unregistered user: {username}")
+                    self._online_users_reply = None
+                    logger.info("Unregistered user: %s", username)
 
-    def _cleanup_stale_users(self):
-        """Periodically remove users who haven't sent heartbeats"""
-        while self.running:
-            time.sleep(30)  # Check every 30 seconds
-            current_time = time.time()
-            stale_threshold = 60  # Consider users stale after 60 seconds
+    def _schedule_expiry(self, username, last_seen):
+        """
+        Queue the time at which a user goes stale unless heard from again.
 
-            to_remove = []
+        Must be called with self.lock held.
 
+        Args:
+            username: User that was just heard from
+            last_seen: Time the user was heard from
+        """
+        heapq.heappush(
+            self._expiry_heap, (last_seen + USER_STALE_TIMEOUT, username, last_seen)
+        )
+
+    def _cleanup_stale_users(self):
+        """Remove users who haven't sent heartbeats, as their entries expire"""
+        while self.running:
             with self.lock:
-                for username, data in self.online_users.items():
-                    if current_time - data["last_seen"] > stale_threshold:
-                        to_remove.append(username)
+                current_time = time.time()
+                heap = self._expiry_heap
+                while heap and heap[0][0] <= current_time:
+                    _, username, last_seen = heapq.heappop(heap)
+                    data = self.online_users.get(username)
+                    # Skip entries superseded by a later heartbeat
+                    if data is not None and data["last_seen"] == last_seen:
+                        del self.online_users[username]
+                        self._online_users_reply = None
+                        logger.info("Removed stale user: %s", username)
 
-                for username in to_remove:
-                    del self.online_users[username]
-                    print(f"Removed stale user: {username}")
+                # Sleep until the next entry expires; new entries always
+                # expire later than that
+                delay = heap[0][0] - current_time if heap else USER_STALE_TIMEOUT
+
+            self._cleanup_wakeup.wait(delay)
 
 
 # When running as a standalone script, start the presence server
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     server = PresenceServer()
     try:
         server.start()
     except KeyboardInterrupt:
-        print("Stopping presence server...")
+        logger.info("Stopping presence server...")
         server.stop()
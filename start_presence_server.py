@@ -4,16 +4,22 @@ Simple script to start the presence server.
 Run this script before trying to use presence-based connections.
 """
 
+import logging
+
 from presence_server import PresenceServer
 
+logger = logging.getLogger(__name__)
+
 if __name__ == "__main__":
-    print("Starting P2P Chat Presence Server...")
-    print("Press Ctrl+C to stop the server.")
+    # Show the server's user events, formatted like plain prints
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logger.info("Starting P2P Chat Presence Server...")
+    logger.info("Press Ctrl+C to stop the server.")
 
     server = PresenceServer()
     try:
         server.start()
     except KeyboardInterrupt:
-        print("\nStopping presence server...")
+        logger.info("Stopping presence server...")
         server.stop()
-        print("Server stopped.")
+        logger.info("Server stopped.")
@@ -2,100 +2,414 @@
 """
 Utility functions for network communication in the P2P chat application.
 This module provides message framing to ensure complete messages are sent and received.
+
+Each frame is an 8-byte prefix holding the JSON header length and the binary
+payload length (two 4-byte integers in network byte order), followed by the
+JSON header and then the raw payload bytes. Binary data such as file chunks
+travels as the payload, so it never has to be base64-encoded into the JSON.
 """
 import socket
+import select
+import ipaddress
 import json
 import struct
+import logging
+import threading
+
+try:
+    import orjson
+except ImportError:  # orjson is optional (e.g. unavailable on PyPy)
+    orjson = None
+
+if orjson is not None:
+    # orjson serializes straight to bytes and parses bytes (or a memoryview
+    # of the receive buffer) without decoding or copying them first
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:
+
+    def _dumps(message: dict) -> bytes:
+        return json.dumps(message).encode()
+
+    def _loads(data) -> dict:
+        # json.loads does not accept memoryviews
+        return json.loads(bytes(data))
+
+# Framing errors are logged rather than printed; the application decides
+# whether and where they are shown
+logger = logging.getLogger(__name__)
+
+# Kernel send/receive buffer size for peer sockets; large enough that bulk
+# file chunks never stall on a full buffer.
+SOCKET_BUFFER_SIZE = 4 << 20
+
+# Upper bound on a single framed message, checked from the length prefix
+# before anything is allocated. The largest legitimate frame is a file chunk
+# of at most 1MB, so this leaves ample headroom while keeping a bogus prefix
+# from reserving a large buffer.
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024  # 16MB
+
+# Free space FrameBuffer keeps available for each socket read
+RECV_BUFFER_SIZE = 64 * 1024
+
+# Payloads larger than this are received directly into their own buffer
+# instead of being copied out of the shared receive buffer
+DIRECT_PAYLOAD_SIZE = RECV_BUFFER_SIZE
+
+# Largest control message sent as a single UDP datagram; keeps datagrams
+# under a typical path MTU so they are never fragmented.
+MAX_DATAGRAM_SIZE = 1200
+
+# Seconds allowed for establishing an outbound TCP connection, so a dead
+# peer fails fast instead of blocking for the kernel's connect timeout
+CONNECT_TIMEOUT = 2.0
+
+# Payloads up to this size are copied into the frame so it goes out in a
+# single send; larger ones are written straight from the caller's buffer.
+_COALESCE_LIMIT = 16 * 1024
+
+# MSG_MORE only exists on Linux; elsewhere frames are pushed immediately.
+_MSG_MORE = getattr(socket, "MSG_MORE", 0)
+
+# MSG_DONTWAIT makes a single recv() non-blocking without touching the
+# socket's mode; it is missing on Windows.
+_MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+# Frame prefix: header and payload lengths as 4-byte integers in network
+# byte order, compiled once instead of parsing the format on every frame
+_FRAME_PREFIX = struct.Struct("!II")
+
+
+def tune_socket(sock: socket.socket, buffer_size: int = SOCKET_BUFFER_SIZE):
+    """
+    Apply the TCP options used for all peer connections.
+
+    Nagle's algorithm is disabled so small control messages go out
+    immediately, keepalive probes let the kernel notice dead peers on idle
+    connections, and the kernel buffers are enlarged for bulk transfers.
+    On a listening socket the options are inherited by accepted connections.
+
+    Args:
+        sock: TCP socket to configure (before connect/listen)
+        buffer_size: Requested SO_SNDBUF and SO_RCVBUF size in bytes
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+
+
+def open_connection(peer_addr: tuple, timeout: float = CONNECT_TIMEOUT) -> socket.socket:
+    """
+    Open a tuned TCP connection to a peer with a bounded connect time.
+
+    Peers are normally given as numeric IP addresses; those are resolved
+    with AI_NUMERICHOST so no DNS lookup is attempted. The returned socket
+    is in blocking mode, so large sends never time out.
+
+    Args:
+        peer_addr: (host, port) tuple of the peer
+        timeout: Seconds to wait for the connection to be established
+
+    Returns:
+        The connected socket
+
+    Raises:
+        OSError: If the address cannot be resolved or the connection fails
+    """
+    host, port = peer_addr
+    try:
+        ipaddress.ip_address(host)
+        flags = socket.AI_NUMERICHOST
+    except ValueError:
+        flags = 0
+
+    error = None
+    for family, sock_type, proto, _, address in socket.getaddrinfo(
+        host, port, socket.AF_INET, socket.SOCK_STREAM, 0, flags
+    ):
+        sock = socket.socket(family, sock_type, proto)
+        try:
+            tune_socket(sock)
+            sock.settimeout(timeout)
+            sock.connect(address)
+            sock.settimeout(None)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError(f"No address found for {host}")
+
+
+def encode_header(message) -> bytes:
+    """
+    Serialize a message header to JSON bytes.
+
+    Headers that are sent many times (e.g. for every chunk of a file) can be
+    encoded once with this function and the bytes passed wherever a message
+    is expected, so they are not re-serialized for each frame.
+
+    Args:
+        message: Dictionary containing the message data, or bytes that were
+            already returned by encode_header
+
+    Returns:
+        The JSON header bytes
+    """
+    if isinstance(message, bytes):
+        return message
+    return _dumps(message)
+
+
+def encode_message(message, payload: bytes = b"") -> bytes:
+    """
+    Serialize a message into a complete length-prefixed frame.
+
+    Args:
+        message: Dictionary containing the message data, or pre-encoded
+            header bytes from encode_header
+        payload: Optional raw binary data carried after the JSON header
+
+    Returns:
+        The frame bytes, ready to be written to a socket
+    """
+    # Convert message to JSON bytes
+    data = encode_header(message)
+
+    # Prefix with header and payload lengths; joining copies every part once
+    return b"".join((_FRAME_PREFIX.pack(len(data), len(payload)), data, payload))
+
+
+class FileRegion:
+    """
+    A byte range of an open file used as a frame payload.
+
+    Regions are written with sendfile(2), so the bytes go from the page
+    cache to the socket without being copied into Python.
+    """
+
+    def __init__(self, file, offset: int, count: int):
+        """
+        Args:
+            file: Regular file object opened in binary mode
+            offset: Position of the first byte to send
+            count: Number of bytes to send
+        """
+        self.file = file
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+
+def write_frame(sock: socket.socket, message, payload=b"", flags: int = 0):
+    """
+    Write one frame to a socket, raising on failure.
+
+    Args:
+        sock: Blocking socket to write to
+        message: Dictionary containing the message data, or pre-encoded
+            header bytes from encode_header
+        payload: Raw bytes, a memoryview or a FileRegion to send after the
+            JSON header
+        flags: send() flags for the frame (e.g. MSG_MORE)
+    """
+    if not isinstance(payload, FileRegion):
+        if len(payload) <= _COALESCE_LIMIT:
+            sock.sendall(encode_message(message, payload), flags)
+            return
+        # Large buffers (e.g. memoryview slices of an mmap) are sent in place
+        # rather than being concatenated into a new bytes object
+        header = encode_header(message)
+        prefix = _FRAME_PREFIX.pack(len(header), len(payload)) + header
+        if hasattr(sock, "sendmsg"):
+            # Scatter-gather: header and payload leave in one syscall
+            _sendmsg_all(sock, [prefix, payload], flags)
+        else:
+            sock.sendall(prefix, _MSG_MORE | flags)
+            sock.sendall(payload, flags)
+        return
+
+    # Header first, then let the kernel copy the file range directly
+    header = encode_header(message)
+    sock.sendall(
+        _FRAME_PREFIX.pack(len(header), payload.count) + header, _MSG_MORE | flags
+    )
+    sent = sock.sendfile(payload.file, payload.offset, payload.count)
+    if sent != payload.count:
+        raise ConnectionError(f"File ended after {sent} of {payload.count} bytes")
+
+
+def _sendmsg_all(sock: socket.socket, buffers: list, flags: int = 0):
+    """
+    Write several buffers with sendmsg(), resuming after partial writes.
+
+    Args:
+        sock: Blocking socket to write to
+        buffers: Bytes-like objects to send in order
+        flags: send() flags for the write
+    """
+    views = [memoryview(buffer).cast("B") for buffer in buffers]
+    while views:
+        sent = sock.sendmsg(views, (), flags)
+        # Drop the buffers that were fully sent and trim the partial one
+        while views and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if views:
+            views[0] = views[0][sent:]
+
+
+def send_datagram(sock: socket.socket, address: tuple, message) -> bool:
+    """
+    Send a small control message as a single UDP datagram.
+
+    Datagrams need no connection setup or teardown, so they are used for
+    frequent fire-and-forget messages such as heartbeats.
+
+    Args:
+        sock: Unconnected UDP socket to send from
+        address: (host, port) of the recipient
+        message: Dictionary containing the message data, or bytes from
+            encode_header when the same message goes to many peers
+
+    Returns:
+        bool: True if sent, False if the message is too large for a datagram
+    """
+    data = encode_header(message)
+    if len(data) > MAX_DATAGRAM_SIZE:
+        return False
+    sock.sendto(data, address)
+    return True
 
 
-def send_message(sock: socket.socket, message: dict):
+def decode_datagram(data: bytes) -> dict:
+    """
+    Parse a datagram produced by send_datagram.
+
+    Args:
+        data: Raw datagram payload
+
+    Returns:
+        Parsed message dictionary or None if it is not a valid message
+    """
+    try:
+        message = _loads(data)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+    return message if isinstance(message, dict) else None
+
+
+def send_message(sock: socket.socket, message: dict, payload=b""):
     """
     Send a message with proper length prefix for framing.
 
     This function handles the message framing protocol:
     1. Convert message dict to JSON
-    2. Add a 4-byte length prefix
-    3. Send the complete packet
+    2. Add the 8-byte header/payload length prefix
+    3. Send the complete packet, including any binary payload
 
     Args:
         sock: Socket connection to send message through
         message: Dictionary containing the message data
+        payload: Optional raw bytes or FileRegion sent after the JSON header
     """
     try:
-        # Convert message to JSON string and encode to bytes
-        data = json.dumps(message).encode()
-
-        # Prefix with message length (4-byte integer in network byte order)
-        length_prefix = struct.pack("!I", len(data))
-
         # Send length prefix followed by the data
-        sock.sendall(length_prefix + data)
+        write_frame(sock, message, payload)
     except Exception as e:
-        print(f"Error sending message: {e}")
+        logger.warning("Error sending message: %s", e)
+
+
+def _recv_exact(sock: socket.socket, length: int) -> bytearray:
+    """
+    Read exactly `length` bytes from a socket.
+
+    The bytes are received straight into one preallocated buffer, so no
+    chunks are collected and joined afterwards.
+
+    Returns:
+        The bytes read, or None if the connection closed first
+    """
+    data = bytearray(length)
+    view = memoryview(data)
+    bytes_received = 0
+    while bytes_received < length:
+        received = sock.recv_into(view[bytes_received:])
+        if not received:
+            return None  # Connection closed unexpectedly
+        bytes_received += received
+    return data
 
 
-def receive_message(sock: socket.socket) -> dict:
+def receive_message(sock: socket.socket, timeout: float = 10.0) -> dict:
     """
     Receive a message with length prefix framing.
 
     This function handles the message framing protocol:
-    1. Read the 4-byte length prefix
-    2. Read the specified number of bytes
+    1. Read the 8-byte length prefix
+    2. Read the JSON header and the binary payload
     3. Parse the JSON message
 
+    A binary payload, if present, is returned as a bytearray under the
+    "data" key.
+
     Args:
         sock: Socket connection to receive message from
+        timeout: Seconds to wait for the message before giving up
 
     Returns:
         Parsed message dictionary or None if an error occurred
     """
     try:
         # Set a timeout to prevent hanging forever
-        sock.settimeout(10.0)  # 10 seconds timeout
+        sock.settimeout(timeout)
 
-        # First read the 4-byte length prefix
-        length_bytes = sock.recv(4)
+        # First read the 8-byte length prefix
+        length_bytes = sock.recv(8)
         if not length_bytes:
             # This is a normal disconnection, no need to print anything
             return None
 
-        if len(length_bytes) < 4:
-            # Only print for incomplete prefixes, not empty ones
-            if len(length_bytes) > 0:
-                print(f"Incomplete length prefix received ({len(length_bytes)} bytes)")
-            return None
+        if len(length_bytes) < 8:
+            rest = _recv_exact(sock, 8 - len(length_bytes))
+            if rest is None:
+                logger.warning(
+                    "Incomplete length prefix received (%d bytes)", len(length_bytes)
+                )
+                return None
+            length_bytes += rest
 
-        # Unpack the length prefix to get the message size
-        message_length = struct.unpack("!I", length_bytes)[0]
+        # Unpack the length prefix to get the header and payload sizes
+        header_length, payload_length = _FRAME_PREFIX.unpack(length_bytes)
 
         # Sanity check to avoid allocating too much memory
-        if message_length > 100 * 1024 * 1024:  # 100MB limit
-            print(f"Message too large: {message_length} bytes")
+        if header_length + payload_length > MAX_MESSAGE_SIZE:
+            logger.warning(
+                "Message too large: %d bytes", header_length + payload_length
+            )
             return None
 
-        # Read the message data in chunks to handle large messages
-        chunks = []
-        bytes_received = 0
-        while bytes_received < message_length:
-            chunk = sock.recv(min(message_length - bytes_received, 4096))
-            if not chunk:
-                print("Connection closed while receiving message data")
-                return None  # Connection closed unexpectedly
-            chunks.append(chunk)
-            bytes_received += len(chunk)
-
-        # Combine all chunks and decode JSON
-        data = b"".join(chunks)
-        return json.loads(data.decode())
+        # Read the header and payload into one buffer
+        data = _recv_exact(sock, header_length + payload_length)
+        if data is None:
+            logger.warning("Connection closed while receiving message data")
+            return None
+
+        # Decode the JSON header and attach the binary payload
+        message = _loads(memoryview(data)[:header_length])
+        if payload_length:
+            message["data"] = data[header_length:]
+        return message
     except socket.timeout:
         # Socket timeouts are normal during polling, don't print
         return None
     except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
+        logger.warning("JSON decode error: %s", e)
         return None
     except Exception as e:
         # Only log actual errors
-        print(f"Error receiving message: {e}")
+        logger.warning("Error receiving message: %s", e)
         return None
     finally:
         # Reset timeout to blocking mode
@@ -103,3 +417,315 @@ def receive_message(sock: socket.socket) -> dict:
             sock.settimeout(None)
         except:
             pass  # Socket might be closed already
+
+
+class FrameBuffer:
+    """
+    Incremental decoder for the length-prefixed framing used by send_message.
+
+    Bytes read from a non-blocking socket are fed in as they arrive; complete
+    messages are returned as soon as all of their bytes are available, while
+    partial frames stay buffered until the next read.
+
+    The buffer is allocated once and reused: recv() reads straight into its
+    free space and frames are parsed in place, so no intermediate bytes
+    object is created per read. Large payloads (such as file chunks) bypass
+    it: once their header is parsed, the rest of the payload is received
+    directly into a bytearray of its own, which becomes the message's data.
+    """
+
+    def __init__(self, size: int = RECV_BUFFER_SIZE):
+        """
+        Args:
+            size: Initial buffer capacity in bytes; it grows for larger frames
+        """
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # First unparsed byte
+        self._end = 0  # End of received data
+        # Message whose large payload is being received directly
+        self._message = None
+        self._payload = None
+        self._payload_view = None
+        self._payload_filled = 0
+
+    def recv(self, sock: socket.socket) -> int:
+        """
+        Read available bytes from a socket into the buffer.
+
+        Call drain() afterwards to decode the completed messages.
+
+        Args:
+            sock: Readable socket to read from
+
+        Returns:
+            Number of bytes read; 0 means the peer closed the connection
+        """
+        if self._payload is not None:
+            # Receive the rest of a large payload straight into place
+            received = sock.recv_into(self._payload_view[self._payload_filled :])
+            self._payload_filled += received
+            return received
+
+        pending = self._end - self._start
+        wanted = RECV_BUFFER_SIZE
+        if pending >= 8:
+            # Make room for the rest of the current frame in one go, except
+            # for a large payload, which will not be read into this buffer
+            header_length, payload_length = _FRAME_PREFIX.unpack_from(
+                self._buffer, self._start
+            )
+            if payload_length > DIRECT_PAYLOAD_SIZE:
+                payload_length = 0
+            frame_length = 8 + header_length + payload_length
+            if frame_length <= MAX_MESSAGE_SIZE:
+                wanted = max(wanted, frame_length - pending)
+        self._reserve(wanted)
+
+        received = sock.recv_into(self._view[self._end :])
+        self._end += received
+        return received
+
+    def feed(self, data: bytes) -> list:
+        """
+        Add received bytes and decode every complete message.
+
+        Args:
+            data: Bytes just read from the socket
+
+        Returns:
+            List of parsed message dictionaries (possibly empty)
+
+        Raises:
+            ValueError: If a frame is oversized or does not contain valid JSON
+        """
+        data = memoryview(data)
+        messages = []
+        while data:
+            if self._payload is not None:
+                # Bytes for a large payload go straight into it
+                count = min(len(data), len(self._payload) - self._payload_filled)
+                filled = self._payload_filled
+                self._payload_view[filled : filled + count] = data[:count]
+                self._payload_filled += count
+                data = data[count:]
+            else:
+                self._reserve(len(data))
+                self._view[self._end : self._end + len(data)] = data
+                self._end += len(data)
+                data = data[:0]
+            messages += self.drain()
+        return messages
+
+    def drain(self) -> list:
+        """
+        Decode every complete message currently in the buffer.
+
+        Returns:
+            List of parsed message dictionaries (possibly empty)
+
+        Raises:
+            ValueError: If a frame is oversized or does not contain valid JSON
+        """
+        messages = []
+        if self._payload is not None:
+            if self._payload_filled < len(self._payload):
+                return messages  # Wait for the rest of the payload
+            messages.append(self._message)
+            self._payload_view.release()
+            self._message = self._payload = self._payload_view = None
+
+        buffer = self._buffer
+        start, end = self._start, self._end
+
+        while end - start >= 8:
+            header_length, payload_length = _FRAME_PREFIX.unpack_from(buffer, start)
+            if header_length + payload_length > MAX_MESSAGE_SIZE:
+                raise ValueError(
+                    f"Message too large: {header_length + payload_length} bytes"
+                )
+
+            header_end = start + 8 + header_length
+            frame_end = header_end + payload_length
+            if end < frame_end:
+                if payload_length > DIRECT_PAYLOAD_SIZE and end >= header_end:
+                    # Move what has arrived of a large payload into its own
+                    # buffer; recv() fills in the rest
+                    self._message = _loads(self._view[start + 8 : header_end])
+                    self._payload = bytearray(payload_length)
+                    self._payload_view = memoryview(self._payload)
+                    self._payload_filled = end - header_end
+                    self._payload_view[: self._payload_filled] = self._view[
+                        header_end:end
+                    ]
+                    self._message["data"] = self._payload
+                    start = end
+                break  # Wait for the rest of the frame
+
+            message = _loads(self._view[start + 8 : header_end])
+            if payload_length:
+                message["data"] = bytes(self._view[header_end:frame_end])
+            start = frame_end
+            messages.append(message)
+
+        if start == end:
+            start = end = 0  # Everything consumed; reuse from the front
+        self._start, self._end = start, end
+        return messages
+
+    def _reserve(self, size: int):
+        """Make sure at least `size` bytes are free after the received data."""
+        if len(self._buffer) - self._end >= size:
+            return
+
+        # Move the unparsed bytes to the front, then grow if still too small
+        pending = self._end - self._start
+        if self._start:
+            self._buffer[:pending] = self._buffer[self._start : self._end]
+            self._start, self._end = 0, pending
+        if len(self._buffer) - pending < size:
+            grown = bytearray(max(2 * len(self._buffer), pending + size))
+            grown[:pending] = self._view[:pending]
+            self._view.release()
+            self._buffer = grown
+            self._view = memoryview(grown)
+
+
+class _PooledConnection:
+    """A cached socket plus the lock that serializes writes to it."""
+
+    def __init__(self):
+        self.sock = None
+        self.lock = threading.Lock()
+
+
+class ConnectionPool:
+    """
+    Cache of persistent outbound TCP connections keyed by (host, port).
+
+    Reusing one connection per peer avoids a TCP handshake (and a socket left
+    in TIME_WAIT) for every message. Each connection has its own lock so that
+    frames written by concurrent senders are never interleaved on the wire.
+    """
+
+    def __init__(self):
+        """Initialize an empty connection pool."""
+        self._connections = {}  # (host, port) -> _PooledConnection
+        self._lock = threading.Lock()
+
+    def send(self, peer_addr: tuple, message, payload=b"", more: bool = False):
+        """
+        Send a message to a peer over its cached connection.
+
+        If the cached connection turns out to be broken it is replaced and the
+        send is retried once before the error is raised to the caller.
+
+        Args:
+            peer_addr: (host, port) tuple of the recipient
+            message: Dictionary containing the message, or encoded header bytes
+            payload: Optional raw bytes or FileRegion sent after the JSON header
+            more: True if another frame follows immediately, letting the
+                kernel pack consecutive frames into full segments (MSG_MORE)
+        """
+        flags = _MSG_MORE if more else 0
+        self._write(peer_addr, lambda sock: write_frame(sock, message, payload, flags))
+
+    def send_frames(self, peer_addr: tuple, frames: bytes):
+        """
+        Send one or more complete frames to a peer with a single write.
+
+        Retried once on a broken cached connection, like send().
+
+        Args:
+            peer_addr: (host, port) tuple of the recipient
+            frames: Concatenated frames built with encode_message
+        """
+        self._write(peer_addr, lambda sock: sock.sendall(frames))
+
+    def close_all(self):
+        """Close every cached connection."""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+
+        for conn in connections:
+            with conn.lock:
+                self._close(conn)
+
+    def _write(self, peer_addr: tuple, write):
+        """
+        Run a write on the peer's cached connection while holding its lock.
+
+        Args:
+            peer_addr: (host, port) tuple of the recipient
+            write: Function taking the connected socket and writing to it
+        """
+        conn = self._get_entry(peer_addr)
+        with conn.lock:
+            for attempt in range(2):
+                sock = self._connect(conn, peer_addr)
+                try:
+                    write(sock)
+                    return
+                except (BrokenPipeError, ConnectionResetError):
+                    self._close(conn)
+                    if attempt:
+                        raise
+                except OSError:
+                    self._close(conn)
+                    raise
+
+    def _get_entry(self, peer_addr: tuple) -> _PooledConnection:
+        """Return the pool entry for a peer, creating it if needed."""
+        with self._lock:
+            conn = self._connections.get(peer_addr)
+            if conn is None:
+                conn = self._connections[peer_addr] = _PooledConnection()
+            return conn
+
+    def _connect(self, conn: _PooledConnection, peer_addr: tuple) -> socket.socket:
+        """Return the entry's socket, opening a new one if it is missing or dead."""
+        if conn.sock is not None and is_connection_alive(conn.sock):
+            return conn.sock
+
+        self._close(conn)
+        sock = open_connection(peer_addr)
+        conn.sock = sock
+        return sock
+
+    @staticmethod
+    def _close(conn: _PooledConnection):
+        """Close and forget the entry's socket, if any."""
+        if conn.sock is not None:
+            try:
+                conn.sock.close()
+            except OSError:
+                pass
+            conn.sock = None
+
+
+def is_connection_alive(sock: socket.socket) -> bool:
+    """
+    Check whether an idle connection can still be written to.
+
+    A pending socket error or an orderly shutdown from the peer (readable
+    with zero bytes available) both mean the connection must be replaced,
+    otherwise the next write would be silently lost.
+    """
+    try:
+        if _MSG_DONTWAIT:
+            # One non-blocking peek: it raises a pending error, returns b""
+            # after a shutdown and would block on a healthy idle connection
+            try:
+                return sock.recv(1, socket.MSG_PEEK | _MSG_DONTWAIT) != b""
+            except BlockingIOError:
+                return True
+
+        if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) != 0:
+            return False
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return True
+        return sock.recv(1, socket.MSG_PEEK) != b""
+    except (OSError, ValueError):
+        return False